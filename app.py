@@ -1,5 +1,5 @@
 
-from flask import Flask, request, jsonify, render_template, send_file, flash, redirect, url_for
+from flask import Flask, request, jsonify, render_template, send_file, flash, redirect, url_for, Response
 import os
 import tempfile
 import uuid
@@ -9,10 +9,34 @@ import requests
 import json
 import re
 import time
+import random
+import math
+import numpy as np
 import pandas as pd
-from word2number import w2n
 import threading
-import queue
+import hashlib
+import shutil
+import zipfile
+import zlib
+import gzip
+import io
+import sqlite3
+from collections import deque, namedtuple
+from collections.abc import MutableMapping
+from functools import lru_cache
+from contextlib import contextmanager
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet and Arrow outputs are unavailable
+    pa = pq = None
+try:
+    import zstandard
+except ImportError:  # zstd-compressed CSV output is unavailable
+    zstandard = None
 
 
 app = Flask(__name__)
@@ -21,36 +45,982 @@ app.secret_key = 'your-secret-key-change-this'
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 OUTPUT_FOLDER = 'outputs'
+CACHE_FOLDER = 'cache'
+DATA_FOLDER = 'data'
 ALLOWED_EXTENSIONS = {'pdf'}
+BATCH_EXTENSIONS = {'zip'}  # Archives of PDFs accepted as one batch upload
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Piece size of chunked uploads (must stay below MAX_CONTENT_LENGTH)
+LARGE_UPLOAD_MAX_SIZE = 2 * 1024 * 1024 * 1024  # 2GB max size of a file uploaded in chunks
+UPLOAD_PART_TTL = 3600  # Seconds an unfinished chunked upload is kept without receiving a chunk
+LLM_CONCURRENCY = 4  # Starting value of the adaptive per-endpoint request limit
+MODEL_NAME = 'llama3'
+MODEL_POOL_SIZE = 16  # Keep-alive connections kept per model host
+MODEL_CONNECT_TIMEOUT = 5  # Seconds to establish a connection to the model endpoint
+MODEL_READ_TIMEOUT = 30  # Seconds to wait for the model's response
+MODEL_MAX_RETRIES = 3  # Retries of a failed model request (connection errors, timeouts, 429/5xx)
+MODEL_RETRY_BACKOFF = 1.0  # Base retry delay in seconds, doubled per attempt, with full jitter
+MODEL_RETRY_BACKOFF_MAX = 30
+MODEL_BREAKER_THRESHOLD = 5  # Consecutive failures that open the circuit breaker
+MODEL_BREAKER_COOLDOWN = 10  # Seconds before a probe request is let through (doubles while failing)
+MODEL_BREAKER_MAX_WAIT = 300  # Seconds requests wait on an open breaker before the task is failed
+MODEL_MAX_CONCURRENCY = 16  # Upper bound of the adaptive per-endpoint request limit
+MODEL_LATENCY_TARGET = 15  # Seconds; slower responses shrink the adaptive limit
+MODEL_STREAMING = False  # Stream responses and stop the generation once the JSON answer is complete
+PROMPT_VERSION = 1  # Bump whenever build_prompt() changes so cached responses are not reused
+CACHE_ENABLED = True
+CACHE_MAX_ENTRIES = 100000  # Least recently used entries are evicted beyond this
+PROMPT_COMPACTION = False  # Send only the lines around field labels instead of the whole page text
+PROMPT_CONTEXT_LINES = 1  # Lines kept before and after each label line when compacting
+BATCH_SIZE = 1  # Pages packed into one model prompt (1 = one prompt per page)
+BATCH_TOKEN_BUDGET = 6000  # Upper bound on estimated prompt tokens per batch
+RULES_FIRST = True  # Fill labelled fields with regexes and only ask the model for what is left
+PAGE_WORKERS = 1  # Processes used for PyMuPDF page extraction (1 = extract on the processing thread)
+PAGE_WORKERS_MIN_PAGES = 50  # Smaller PDFs are always extracted in-process
+PAGE_CHUNK_SIZE = 16  # Pages handed to a worker process at a time
+PAGE_WINDOW = 200  # Longer PDFs are reopened every this many pages to release PyMuPDF's caches (0 = never)
+RESULT_CHUNK_SIZE = 5000  # Page entries read back and merged at a time for the final results
+NUMERIC_RESULTS = False  # Write TotalMarks and SGPA as numbers (values that cannot be parsed are left empty)
+OUTPUT_FORMAT = 'csv'  # Results file format: csv, csv.gz, csv.zst, parquet or arrow (per upload: output_format form field)
+RESULT_ROW_GROUP_SIZE = 10000  # Result rows written at a time (one Parquet row group / Arrow record batch each)
+BATCH_FILE_WORKERS = 2  # PDFs of a batch upload processed at the same time
+BATCH_MAX_MEMBER_SIZE = 200 * 1024 * 1024  # ZIP members larger than this (uncompressed) are skipped
+STATUS_EVENT_INTERVAL = 0.25  # Minimum seconds between progress events of a task (updates in between are coalesced)
+STATUS_EVENT_KEEPALIVE = 15  # Seconds between keep-alive comments on an idle progress stream
+DOWNLOAD_RETRY_AFTER = 2  # Seconds a client is told to wait (Retry-After) before asking for an unfinished result again
+DOWNLOAD_GZIP_MIN_SIZE = 1024 * 1024  # Results at least this large are sent gzip-compressed to clients that accept it (None = never)
+TASK_STATUS_TTL = 3600  # Seconds the status of a finished task is kept after its last update
+TASK_STATUS_MAX = 10000  # Task statuses kept at most; the least recently updated ones are evicted first
+JOB_WORKERS = 2  # Extraction jobs processed at the same time
+JOB_STALE_SECONDS = 60  # Running jobs without a heartbeat for this long are picked up again
+JANITOR_INTERVAL = 60  # Seconds between passes of the background file janitor
+FILE_RETENTION_SECONDS = 24 * 3600  # Uploads and results untouched for this long are removed
+FILE_RETENTION_COUNT = 20  # Result CSVs kept at most; the oldest are removed first
+FILE_RETENTION_BYTES = 1024 * 1024 * 1024  # Total size of uploads and results kept; the oldest are removed first
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+app.config['LLM_CONCURRENCY'] = LLM_CONCURRENCY
+app.config['MODEL_MAX_CONCURRENCY'] = MODEL_MAX_CONCURRENCY
+app.config['MODEL_STREAMING'] = MODEL_STREAMING
+app.config['CACHE_ENABLED'] = CACHE_ENABLED
+app.config['RULES_FIRST'] = RULES_FIRST
+app.config['BATCH_SIZE'] = BATCH_SIZE
+app.config['PROMPT_COMPACTION'] = PROMPT_COMPACTION
+app.config['PROMPT_CONTEXT_LINES'] = PROMPT_CONTEXT_LINES
+app.config['BATCH_TOKEN_BUDGET'] = BATCH_TOKEN_BUDGET
+app.config['PAGE_WORKERS'] = PAGE_WORKERS
+app.config['PAGE_WORKERS_MIN_PAGES'] = PAGE_WORKERS_MIN_PAGES
+app.config['PAGE_CHUNK_SIZE'] = PAGE_CHUNK_SIZE
+app.config['PAGE_WINDOW'] = PAGE_WINDOW
+app.config['RESULT_CHUNK_SIZE'] = RESULT_CHUNK_SIZE
+app.config['LARGE_UPLOAD_MAX_SIZE'] = LARGE_UPLOAD_MAX_SIZE
+app.config['NUMERIC_RESULTS'] = NUMERIC_RESULTS
+app.config['OUTPUT_FORMAT'] = OUTPUT_FORMAT
+app.config['RESULT_ROW_GROUP_SIZE'] = RESULT_ROW_GROUP_SIZE
+app.config['BATCH_FILE_WORKERS'] = BATCH_FILE_WORKERS
+app.config['DOWNLOAD_GZIP_MIN_SIZE'] = DOWNLOAD_GZIP_MIN_SIZE
 
 # Create directories if they don't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+os.makedirs(CACHE_FOLDER, exist_ok=True)
+os.makedirs(DATA_FOLDER, exist_ok=True)
+
+class StatusUpdates:
+    """
+    Wakes up the progress streams of a task when its status changes. Every task has a
+    version number that is bumped on each change; waiters block until it moves on.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._waiters = {}  # task_id -> set of threading.Event
+
+    def notify(self, task_id, final=False):
+        """Wakes the task's waiters. After a final update the version is dropped, so finished tasks take no memory."""
+        with self._lock:
+            if final:
+                self._versions.pop(task_id, None)
+            else:
+                self._versions[task_id] = self._versions.get(task_id, 0) + 1
+            for event in self._waiters.get(task_id, ()):
+                event.set()
+
+    def version(self, task_id):
+        with self._lock:
+            return self._versions.get(task_id, 0)
+
+    def wait(self, task_id, version, timeout):
+        """Waits until the task's version differs from `version` or `timeout` passes; returns the version."""
+        event = threading.Event()
+        with self._lock:
+            if self._versions.get(task_id, 0) != version:
+                return self._versions.get(task_id, 0)
+            self._waiters.setdefault(task_id, set()).add(event)
+        try:
+            event.wait(timeout)
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(task_id)
+                waiters.discard(event)
+                if not waiters:
+                    del self._waiters[task_id]
+        return self.version(task_id)
+
+status_updates = StatusUpdates()
+
+class TaskStore:
+    """
+    Status and download state of every task, kept in SQLite so that all threads and all
+    server processes (e.g. several gunicorn workers) share them. Lookups go by primary key.
+    Finished tasks are evicted ttl seconds after their last update, and at most max_tasks
+    tasks are kept (the least recently updated go first), however many jobs have run.
+    """
+
+    FIELDS = ("status", "download")
+    EVICTION_INTERVAL = 60  # Seconds between evictions, run from set()
+
+    def __init__(self, path, ttl=TASK_STATUS_TTL, max_tasks=TASK_STATUS_MAX):
+        self.path = path
+        self.ttl = ttl
+        self.max_tasks = max_tasks
+        self._lock = threading.Lock()
+        self._last_eviction = 0.0
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        # WAL lets other processes read while one writes; status updates need not survive a power cut
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "task_id TEXT PRIMARY KEY, state TEXT, status TEXT, download TEXT, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_updated ON tasks (updated_at)")
+
+    def get(self, task_id, field):
+        assert field in self.FIELDS
+        with self._lock:
+            row = self._conn.execute(f"SELECT {field} FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(row[0])
+
+    def set(self, task_id, field, value):
+        assert field in self.FIELDS
+        now = time.time()
+        state = value.get("status") if field == "status" else None
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO tasks (task_id, state, {field}, updated_at) VALUES (?, ?, ?, ?) "
+                f"ON CONFLICT (task_id) DO UPDATE SET {field} = excluded.{field}, updated_at = excluded.updated_at, "
+                f"state = COALESCE(excluded.state, state)",
+                (task_id, state, json.dumps(value), now)
+            )
+        if now - self._last_eviction > self.EVICTION_INTERVAL:
+            self.evict()
+
+    def delete(self, task_id, field):
+        """Clears one field of a task; returns False if it was not set."""
+        assert field in self.FIELDS
+        with self._lock:
+            cur = self._conn.execute(
+                f"UPDATE tasks SET {field} = NULL{', state = NULL' if field == 'status' else ''} "
+                f"WHERE task_id = ? AND {field} IS NOT NULL", (task_id,)
+            )
+            self._conn.execute("DELETE FROM tasks WHERE task_id = ? AND status IS NULL AND download IS NULL",
+                               (task_id,))
+        return cur.rowcount > 0
+
+    def task_ids(self, field):
+        assert field in self.FIELDS
+        with self._lock:
+            rows = self._conn.execute(f"SELECT task_id FROM tasks WHERE {field} IS NOT NULL").fetchall()
+        return [row[0] for row in rows]
+
+    def evict(self):
+        """Removes finished tasks older than the TTL and the oldest tasks beyond max_tasks; returns how many."""
+        now = time.time()
+        self._last_eviction = now
+        with self._lock:
+            expired = self._conn.execute(
+                "DELETE FROM tasks WHERE state IN ('completed', 'error') AND updated_at < ?", (now - self.ttl,)
+            ).rowcount
+            overflow = self._conn.execute(
+                "DELETE FROM tasks WHERE task_id IN "
+                "(SELECT task_id FROM tasks ORDER BY updated_at DESC LIMIT -1 OFFSET ?)", (self.max_tasks,)
+            ).rowcount
+        return expired + overflow
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall()
+        return {"tasks": sum(count for _state, count in rows),
+                "by_state": {state or "none": count for state, count in rows}}
+
+class TaskStateView(MutableMapping):
+    """
+    One field of the task store used like a dict keyed by task id (processing_status,
+    download_status). Values are copies: changing a status means assigning it again.
+    """
+
+    def __init__(self, store, field, updates=None):
+        self.store = store
+        self.field = field
+        self.updates = updates
+
+    def __getitem__(self, task_id):
+        value = self.store.get(task_id, self.field)
+        if value is None:
+            raise KeyError(task_id)
+        return value
+
+    def __setitem__(self, task_id, value):
+        self.store.set(task_id, self.field, value)
+        if self.updates is not None:
+            self.updates.notify(task_id, final=value.get("status") in ("completed", "error"))
+
+    def __delitem__(self, task_id):
+        if not self.store.delete(task_id, self.field):
+            raise KeyError(task_id)
+        if self.updates is not None:
+            self.updates.notify(task_id, final=True)
+
+    def __iter__(self):
+        return iter(self.store.task_ids(self.field))
+
+    def __len__(self):
+        return len(self.store.task_ids(self.field))
 
 # Global variables for processing status
-processing_status = {}
-processing_queue = queue.Queue()
-download_status = {}  # Track download status for each task
+task_store = TaskStore(os.path.join(DATA_FOLDER, 'tasks.sqlite3'))
+processing_status = TaskStateView(task_store, "status", updates=status_updates)
+download_status = TaskStateView(task_store, "download")  # Track download status for each task
+
+def allowed_file(filename, extensions=ALLOWED_EXTENSIONS):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in extensions
+
+# ---------------- Model client ----------------
+
+class LatencyHistogram:
+    """Thread-safe cumulative histogram of request latencies in seconds."""
+
+    BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    def observe(self, seconds):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    self._counts[i] += 1
+                    break
+            else:
+                self._counts[-1] += 1
+            self._sum += seconds
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"buckets": buckets, "count": cumulative, "sum": round(total, 4)}
+
+class ModelUnavailableError(Exception):
+    """Raised when the model endpoint stays unavailable for longer than the breaker allows."""
+
+class CircuitBreaker:
+    """
+    Pauses dispatch to a failing model endpoint. After `threshold` consecutive failures the
+    breaker opens and callers wait; after `cooldown` seconds one probe request is let through.
+    A success closes the breaker, a failure opens it again with a doubled cooldown. Once the
+    breaker has been open for `max_wait` seconds, waiting callers get ModelUnavailableError.
+    """
+
+    def __init__(self, threshold=MODEL_BREAKER_THRESHOLD, cooldown=MODEL_BREAKER_COOLDOWN,
+                 max_wait=MODEL_BREAKER_MAX_WAIT):
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.max_wait = max_wait
+        self.state = "closed"
+        self.failures = 0
+        self.opened_count = 0
+        self._cooldown = cooldown
+        self._opened_since = None
+        self._retry_at = 0.0
+        self._cond = threading.Condition()
+
+    def before_request(self, wait=True):
+        with self._cond:
+            while True:
+                if self.state == "closed":
+                    return
+                now = time.time()
+                if self.state == "open" and now >= self._retry_at:
+                    # This caller becomes the probe
+                    self.state = "half_open"
+                    return
+                waited = now - self._opened_since
+                if not wait or waited >= self.max_wait:
+                    raise ModelUnavailableError(
+                        f"Model endpoint unavailable for {waited:.0f}s (circuit breaker open)"
+                    )
+                timeout = self.max_wait - waited
+                if self.state == "open":
+                    timeout = min(timeout, self._retry_at - now)
+                self._cond.wait(timeout=max(timeout, 0.01))
+
+    def record_success(self):
+        with self._cond:
+            if self.state != "closed":
+                print("Model endpoint recovered, closing circuit breaker")
+            self.state = "closed"
+            self.failures = 0
+            self._cooldown = self.base_cooldown
+            self._opened_since = None
+            self._cond.notify_all()
+
+    def record_failure(self):
+        with self._cond:
+            self.failures += 1
+            if self.state == "half_open":
+                self._cooldown = min(self._cooldown * 2, self.base_cooldown * 8)
+            elif self.state == "open" or self.failures < self.threshold:
+                return
+            else:
+                self._opened_since = time.time()
+                self.opened_count += 1
+            print(f"Circuit breaker open, pausing model requests for {self._cooldown:.0f}s")
+            self.state = "open"
+            self._retry_at = time.time() + self._cooldown
+            self._cond.notify_all()
+
+class AdaptiveLimiter:
+    """
+    AIMD limit on concurrent requests to one model endpoint. Each fast success that
+    finishes while the limit is in full use raises it by 1/limit (about +1 per round of
+    requests), so the limit only grows when more requests are actually waiting; an error
+    or a response slower than `latency_target` halves it, at most once per second.
+    """
+
+    def __init__(self, initial=LLM_CONCURRENCY, minimum=1, maximum=MODEL_MAX_CONCURRENCY,
+                 latency_target=MODEL_LATENCY_TARGET):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, ok, latency):
+        with self._cond:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            now = time.time()
+            if ok and latency <= self.latency_target:
+                if saturated:
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            elif now - self._last_decrease >= 1:
+                self.limit = max(self.minimum, self.limit / 2)
+                self._last_decrease = now
+            self._cond.notify_all()
+
+class StreamedGeneration:
+    """Result of a streamed generation: the text received and when the first token and the JSON arrived."""
+
+    def __init__(self, status_code, response, first_token_seconds=None, json_seconds=None):
+        self.status_code = status_code
+        self.response = response
+        self.first_token_seconds = first_token_seconds
+        self.json_seconds = json_seconds
+        self.stopped_early = json_seconds is not None
+
+def first_complete_json(text, opener="{"):
+    """
+    Returns the first balanced JSON object (opener "{") or array (opener "[") in text,
+    or None while it is still incomplete. Brackets inside strings are ignored.
+    """
+    start = text.find(opener)
+    if start < 0:
+        return None
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            depth += 1
+        elif ch in "}]":
+            depth -= 1
+            if depth == 0:
+                return text[start:i+1]
+    return None
+
+def complete_result_object(text):
+    """Stream stop condition for single-page prompts: a JSON object with all result fields."""
+    candidate = first_complete_json(text, "{")
+    if candidate is None:
+        return False
+    try:
+        obj = json.loads(candidate)
+    except ValueError:
+        return False
+    return isinstance(obj, dict) and all(field in obj for field in RESULT_FIELDS)
+
+def complete_result_array(text):
+    """Stream stop condition for batch prompts: a complete JSON array."""
+    candidate = first_complete_json(text, "[")
+    if candidate is None:
+        return False
+    try:
+        return isinstance(json.loads(candidate), list)
+    except ValueError:
+        return False
+
+class ModelClient:
+    """
+    Shared, thread-safe client for the AI model endpoint. Requests go through one
+    requests.Session whose connection pool keeps connections to the model host alive,
+    and every request's latency is recorded in a histogram.
+    Each endpoint gets a circuit breaker and an adaptive concurrency limit; failed
+    requests are retried with exponential backoff and jitter.
+    """
+
+    RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, model_name=MODEL_NAME, pool_size=MODEL_POOL_SIZE,
+                 connect_timeout=MODEL_CONNECT_TIMEOUT, read_timeout=MODEL_READ_TIMEOUT,
+                 max_retries=MODEL_MAX_RETRIES):
+        self.model_name = model_name
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.latency = LatencyHistogram()
+        self.first_token = LatencyHistogram()
+        self.time_to_json = LatencyHistogram()
+        self.errors = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+        self._endpoints = {}  # model_endpoint_url -> (CircuitBreaker, AdaptiveLimiter)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _guards(self, model_endpoint_url):
+        with self._lock:
+            if model_endpoint_url not in self._endpoints:
+                limiter = AdaptiveLimiter(initial=app.config['LLM_CONCURRENCY'],
+                                          maximum=app.config['MODEL_MAX_CONCURRENCY'])
+                self._endpoints[model_endpoint_url] = (CircuitBreaker(), limiter)
+            return self._endpoints[model_endpoint_url]
+
+    def generate(self, model_endpoint_url, prompt, retries=None, wait_for_breaker=True, stream_until=None):
+        """
+        POSTs a prompt to an Ollama-style /api/generate endpoint and returns the response.
+        The last response (or request exception) is returned (or raised) once retries run out;
+        ModelUnavailableError is raised while the endpoint's circuit breaker refuses requests.
+        With `stream_until`, the response is streamed and a StreamedGeneration is returned
+        as soon as stream_until(text_so_far) is true or the generation ends.
+        """
+        breaker, limiter = self._guards(model_endpoint_url)
+        if retries is None:
+            retries = self.max_retries
+
+        for attempt in range(retries + 1):
+            breaker.before_request(wait=wait_for_breaker)
+            limiter.acquire()
+            resp = None
+            error = None
+            start = time.perf_counter()
+            try:
+                resp = self.session.post(
+                    model_endpoint_url,
+                    json={"model": self.model_name, "prompt": prompt, "stream": stream_until is not None},
+                    timeout=self.timeout,
+                    stream=stream_until is not None
+                )
+                if stream_until is not None and resp.status_code == 200:
+                    resp = self._read_stream(resp, stream_until, start)
+            except requests.exceptions.RequestException as e:
+                error = e
+            finally:
+                latency = time.perf_counter() - start
+                self.latency.observe(latency)
+                ok = resp is not None and resp.status_code not in self.RETRYABLE_STATUS
+                limiter.release(ok, latency)
+
+            if ok:
+                breaker.record_success()
+                return resp
+
+            breaker.record_failure()
+            with self._lock:
+                self.errors += 1
+            if attempt == retries:
+                break
+            reason = error if error is not None else f"status {resp.status_code}"
+            delay = random.uniform(0, min(MODEL_RETRY_BACKOFF_MAX, MODEL_RETRY_BACKOFF * 2 ** attempt))
+            print(f"Model request failed ({reason}), retry {attempt+1}/{retries} in {delay:.1f}s")
+            with self._lock:
+                self.retries += 1
+            time.sleep(delay)
+
+        if error is not None:
+            raise error
+        return resp
+
+    def _read_stream(self, resp, stream_until, start):
+        pieces = []
+        first_token_seconds = None
+        json_seconds = None
+        try:
+            for line in resp.iter_lines():
+                if not line:
+                    continue
+                try:
+                    chunk = json.loads(line)
+                except ValueError:
+                    continue
+                piece = chunk.get("response", "")
+                if piece:
+                    if first_token_seconds is None:
+                        first_token_seconds = time.perf_counter() - start
+                    pieces.append(piece)
+                    if stream_until("".join(pieces)):
+                        json_seconds = time.perf_counter() - start
+                        break
+                if chunk.get("done"):
+                    break
+        finally:
+            # Closing a partly read response drops the connection, which cancels the generation
+            resp.close()
+
+        if first_token_seconds is not None:
+            self.first_token.observe(first_token_seconds)
+        if json_seconds is not None:
+            self.time_to_json.observe(json_seconds)
+        return StreamedGeneration(resp.status_code, "".join(pieces), first_token_seconds, json_seconds)
+
+    def stats(self):
+        with self._lock:
+            errors = self.errors
+            retries = self.retries
+            endpoints = dict(self._endpoints)
+        return {
+            "model": self.model_name,
+            "connect_timeout": self.timeout[0],
+            "read_timeout": self.timeout[1],
+            "request_errors": errors,
+            "retries": retries,
+            "latency_seconds": self.latency.snapshot(),
+            "first_token_seconds": self.first_token.snapshot(),
+            "time_to_json_seconds": self.time_to_json.snapshot(),
+            "endpoints": {
+                url: {
+                    "breaker_state": breaker.state,
+                    "breaker_opened": breaker.opened_count,
+                    "concurrency_limit": round(limiter.limit, 2),
+                    "in_flight": limiter.in_flight
+                }
+                for url, (breaker, limiter) in endpoints.items()
+            }
+        }
+
+model_client = ModelClient()
+
+# ---------------- Extraction cache ----------------
+
+class ExtractionCache:
+    """
+    Persistent SQLite cache of parsed model responses.
+    Entries are keyed by a hash of the prompt version, the model name and the page text,
+    and the least recently used entries are evicted once max_entries is exceeded.
+    """
+
+    def __init__(self, path, max_entries=CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS extractions ("
+            "key TEXT PRIMARY KEY, model_json TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_extractions_last_used ON extractions (last_used)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM extractions").fetchone()[0]
+
+    @staticmethod
+    def make_key(page_text, model_name=MODEL_NAME, prompt_version=PROMPT_VERSION, prompt_kind="page"):
+        """
+        Cache key of a page's answer. `prompt_kind` names the prompt that produced it:
+        "page" for build_prompt(), "batch<N>" for build_batch_prompt() with batch size N,
+        so answers to one prompt are never served when another is in use.
+        """
+        digest = hashlib.sha256()
+        digest.update(f"{prompt_version}\0{model_name}\0".encode("utf-8"))
+        if prompt_kind != "page":  # Keeps the keys of single-page answers cached before batching
+            digest.update(f"{prompt_kind}\0".encode("utf-8"))
+        digest.update(page_text.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT model_json FROM extractions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE extractions SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, key, model_json):
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO extractions (key, model_json, last_used) VALUES (?, ?, ?)",
+                (key, json.dumps(model_json), time.time())
+            )
+            self._count += cur.rowcount
+            excess = self._count - self.max_entries
+            if excess > 0:
+                cur = self._conn.execute(
+                    "DELETE FROM extractions WHERE key IN "
+                    "(SELECT key FROM extractions ORDER BY last_used ASC LIMIT ?)",
+                    (excess,)
+                )
+                self._count -= cur.rowcount
+                self.evictions += cur.rowcount
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": self._count,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+extraction_cache = ExtractionCache(os.path.join(CACHE_FOLDER, 'extractions.sqlite3'))
+
+# ---------------- Task metrics ----------------
+
+STAGES = (
+    "pdf_extraction",  # PyMuPDF text extraction and the regex page helpers (waiting time with worker processes)
+    "model_request",   # Model requests, including retries and backoff
+    "json_parse",      # Parsing model answers
+    "fallbacks",       # Total marks and name fallbacks when building a page entry
+    "merge",           # merge_students over the finished pages
+    "csv_write"        # Building the DataFrame and writing the CSV
+)
+COUNTERS = ("pages", "rules_only_pages", "model_requests", "model_errors", "json_parse_errors",
+            "cache_hits", "cache_misses", "total_marks_fallbacks", "name_fallbacks")
+
+class MetricsRegistry:
+    """Process-wide totals of all task metrics, exported by /metrics in Prometheus text format."""
+
+    STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30, 120)
+
+    def __init__(self):
+        self.stage_seconds = {stage: LatencyHistogram(self.STAGE_BUCKETS) for stage in STAGES}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.tasks = {"completed": 0, "error": 0}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        self.stage_seconds[stage].observe(seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def task_finished(self, status):
+        with self._lock:
+            self.tasks[status] = self.tasks.get(status, 0) + 1
+
+    def render(self):
+        """Returns all metrics, including model client, cache and job queue stats, as Prometheus text."""
+        lines = []
+
+        def histogram(name, help_text, snapshots):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, snapshot in snapshots:
+                sep = "," if labels else ""
+                for bound, count in snapshot["buckets"].items():
+                    lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {count}')
+                suffix = f"{{{labels}}}" if labels else ""
+                lines.append(f"{name}_sum{suffix} {snapshot['sum']}")
+                lines.append(f"{name}_count{suffix} {snapshot['count']}")
+
+        def sample(name, help_text, kind, values):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in values:
+                lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+
+        with self._lock:
+            counters = dict(self.counters)
+            tasks = dict(self.tasks)
+
+        histogram("extractor_stage_seconds", "Time spent per extraction stage.",
+                  [(f'stage="{stage}"', self.stage_seconds[stage].snapshot()) for stage in STAGES])
+        for name in COUNTERS:
+            sample(f"extractor_{name}_total", f"{name.replace('_', ' ').capitalize()} across all tasks.",
+                   "counter", [("", counters[name])])
+        sample("extractor_tasks_total", "Finished extraction tasks by outcome.", "counter",
+               [(f'status="{status}"', count) for status, count in tasks.items()])
+
+        client = model_client.stats()
+        histogram("extractor_model_request_seconds", "Latency of single model HTTP requests.",
+                  [("", client["latency_seconds"])])
+        sample("extractor_model_request_errors_total", "Failed model HTTP requests.", "counter",
+               [("", client["request_errors"])])
+        sample("extractor_model_retries_total", "Retried model HTTP requests.", "counter",
+               [("", client["retries"])])
+
+        cache = extraction_cache.stats()
+        sample("extractor_cache_entries", "Entries in the extraction cache.", "gauge", [("", cache["entries"])])
+        sample("extractor_cache_evictions_total", "Extraction cache evictions.", "counter",
+               [("", cache["evictions"])])
+
+        jobs = job_queue.stats()
+        sample("extractor_jobs", "Jobs in the job queue by status.", "gauge",
+               [(f'status="{status}"', jobs.get(status, 0)) for status in ("queued", "running", "completed", "error")])
+        return "\n".join(lines) + "\n"
+
+metrics_registry = MetricsRegistry()
+
+class TaskMetrics:
+    """
+    Stage timers and counters of one extraction task. Safe to use from the model request
+    threads; everything recorded is also added to the process-wide metrics_registry.
+    """
+
+    def __init__(self, registry=None):
+        self.registry = registry if registry is not None else metrics_registry
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.calls = dict.fromkeys(STAGES, 0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self.seconds[stage] += seconds
+            self.calls[stage] += 1
+        self.registry.observe(stage, seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def timed_iter(self, stage, iterable):
+        """Yields from iterable, timing how long each item takes to produce."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.observe(stage, time.perf_counter() - start)
+            yield item
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+        self.registry.count(name, n)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "stages": {
+                    stage: {"seconds": round(self.seconds[stage], 4), "calls": self.calls[stage]}
+                    for stage in STAGES
+                },
+                "counters": dict(self.counters)
+            }
+
+task_metrics = {}  # task_id -> TaskMetrics of running tasks
 
 # ---------------- Helper functions (from your original code) ----------------
 
+class PageLayout:
+    """
+    Text layout of a single PDF page, extracted once and shared by all page helpers.
+    Holds the plain text, the flattened text lines as (line_text, y) in document
+    order, and the text blocks.
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self.text = page.get_text("text", sort=True)
+        self.lines = []
+        self._blocks = None
+        try:
+            pdict = page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)
+            blocks = []
+            for block in pdict.get("blocks", []):
+                block_text = ""
+                for line in block.get("lines", []):
+                    spans = line.get("spans", [])
+                    raw_text = "".join([span.get("text", "") for span in spans])
+                    block_text += raw_text + "\n"
+                    line_text = raw_text.strip()
+                    if line_text:
+                        ys = [span["bbox"][1] for span in spans]
+                        self.lines.append((line_text, min(ys) if ys else None))
+                if block.get("type", 0) == 0:
+                    blocks.append((*block["bbox"], block_text, block["number"], 0))
+            # Same blocks, in the same order, as page.get_text("blocks", sort=True), whose
+            # result PyMuPDF 1.26 never frees (a leak of a few KB per page)
+            blocks.sort(key=lambda b: (b[3], b[0]))
+            self._blocks = blocks
+        except Exception:
+            self.lines = [(ln, None) for ln in self.text.splitlines()]
+        self._label_scans = {}
+
+    def detach(self):
+        """
+        Reads everything still lazy and drops the page reference, so the layout can be
+        pickled (e.g. sent back from a worker process) and outlives its document.
+        """
+        self.blocks
+        self.page = None
+        return self
+
+    @property
+    def blocks(self):
+        if self._blocks is None:
+            self._blocks = self.page.get_text("blocks", sort=True)
+        return self._blocks
+
+    @property
+    def line_texts(self):
+        return [ln for ln, _y in self.lines]
+
+    @property
+    def lines_by_y(self):
+        return sorted(self.lines, key=lambda x: (x[1] if x[1] is not None else 0))
+
+    @property
+    def y_order(self):
+        """Indexes into self.lines in the order of lines_by_y."""
+        return sorted(range(len(self.lines)), key=lambda i: (self.lines[i][1] if self.lines[i][1] is not None else 0))
+
+    def label_scan(self, labels):
+        """The LabelMatcher scan of this page's lines, done once per set of name labels."""
+        scan = self._label_scans.get(labels.name_label_variants)
+        if scan is None:
+            scan = self._label_scans[labels.name_label_variants] = labels.scan(self.line_texts)
+        return scan
+
+NUMBER_WORDS = {
+    "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+    "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "thirteen": 13, "fourteen": 14,
+    "fifteen": 15, "sixteen": 16, "seventeen": 17, "eighteen": 18, "nineteen": 19, "twenty": 20,
+    "thirty": 30, "forty": 40, "fifty": 50, "sixty": 60, "seventy": 70, "eighty": 80, "ninety": 90,
+    "hundred": 100, "thousand": 1000, "lac": 100000, "lakh": 100000, "million": 1000000,
+    "crore": 10000000, "billion": 1000000000
+}
+NUMBER_WORD_TOKEN = re.compile(r"[a-z]+")
+
+@lru_cache(maxsize=4096)
+def words_to_number(text):
+    """
+    Converts number words such as 'Four Hundred and Fifteen' or 'One Lakh Twenty Thousand'
+    to an int (a float with 'point'), the same as word2number's word_to_num() for
+    well-formed input. Words that are not number words are skipped. Returns None,
+    instead of raising, when there are no number words or the scales (including
+    'hundred') are out of order.
+    """
+    text = text.lower()
+    # isdecimal(), not isdigit(): int() rejects digit characters such as '²'
+    if text.strip().isdecimal():
+        return int(text)
+    words = [w for w in NUMBER_WORD_TOKEN.findall(text) if w in NUMBER_WORDS or w == "point"]
+    if not words:
+        return None
+
+    decimals = []
+    if "point" in words:
+        point = words.index("point")
+        words, decimals = words[:point], words[point + 1:]
+        if "point" in decimals:
+            return None
+
+    total = current = 0
+    last_scale = None
+    for word in words:
+        value = NUMBER_WORDS[word]
+        if value == 100:
+            # 'hundred' only multiplies what is below it: not 'five hundred hundred', nor the
+            # 'five hundred' of 'four hundred fifteen out of five hundred' onto 415
+            if current >= 100:
+                return None
+            current = (current or 1) * 100
+        elif value >= 1000:
+            # Scales must get smaller: 'two lakh five thousand', not 'five thousand two lakh'
+            if last_scale is not None and value >= last_scale:
+                return None
+            last_scale = value
+            total += (current or 1) * value
+            current = 0
+        else:
+            current += value
+    number = total + current
+
+    if decimals:
+        if all(NUMBER_WORDS.get(w, 10) < 10 for w in decimals):
+            number += float("0." + "".join(str(NUMBER_WORDS[w]) for w in decimals))
+    return number
+
 def clean_total_marks(total):
     """
     Cleans total marks string into an integer if possible.
     Handles numbers, numbers with commas, and words (e.g., 'Four Hundred Fifteen').
+    Returns None for anything that cannot be parsed.
     """
     if total is None:
         return None
     if isinstance(total, (int, float)):
-        return int(total)
+        return int(total) if math.isfinite(total) else None
 
     if isinstance(total, str):
         s = total.strip()
@@ -61,28 +1031,17 @@ def clean_total_marks(total):
         try:
             return int(s_clean)
         except ValueError:
-            try:
-                return w2n.word_to_num(s_clean.lower())
-            except Exception:
-                return None
+            return words_to_number(s_clean)
     return None
 
-def fallback_total_marks(page, page_text):
+def fallback_total_marks(layout):
     """
     Robust fallback: search page lines/blocks for 'Total Marks' phrasing,
     prefer the 'in words' value, otherwise pick the most-likely numeric (last number on the line).
     """
-    # 1) Try line-by-line search using page dict (keeps visual order)
-    try:
-        pdict = page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)
-        lines = []
-        for block in pdict.get("blocks", []):
-            for line in block.get("lines", []):
-                line_text = "".join([span.get("text", "") for span in line.get("spans", [])]).strip()
-                if line_text:
-                    lines.append(line_text)
-    except Exception:
-        lines = page_text.splitlines()
+    page_text = layout.text
+    # 1) Try line-by-line search using the page lines (keeps visual order)
+    lines = layout.line_texts
 
     for idx, line in enumerate(lines):
         low = line.lower()
@@ -95,12 +1054,10 @@ def fallback_total_marks(page, page_text):
             # 1A. Look for "(in words): <words>" or "in words : <words>"
             m_words = re.search(r"in\s+words[^\w\-]*[:\-]?\s*([a-z\s\-]+)", context, re.IGNORECASE)
             if m_words:
-                words = m_words.group(1).strip()
-                try:
-                    return w2n.word_to_num(words.lower())
-                except Exception:
-                    # fall through to numeric attempt
-                    pass
+                value = words_to_number(m_words.group(1).strip())
+                if value is not None:
+                    return value
+                # otherwise fall through to numeric attempt
 
             # 1B. If no word-form, try to find numeric groups in the same line/context.
             nums = re.findall(r"\d{1,4}", context)
@@ -116,10 +1073,9 @@ def fallback_total_marks(page, page_text):
     m_global_words = re.search(r"Total\s+Marks\s+Obtained.*?in\s+words[^\w\-]*[:\-]?\s*([A-Za-z\s\-]+)",
                                page_text, re.IGNORECASE | re.DOTALL)
     if m_global_words:
-        try:
-            return w2n.word_to_num(m_global_words.group(1).strip().lower())
-        except Exception:
-            pass
+        value = words_to_number(m_global_words.group(1).strip())
+        if value is not None:
+            return value
 
     # 3) As last resort, find any occurrence of "Total" followed by numbers and pick last numeric token on that line
     m_lines = page_text.splitlines()
@@ -134,6 +1090,11 @@ def fallback_total_marks(page, page_text):
 
     return None
 
+DEFAULT_NAME_LABELS = ("Student Name", "Name of Student", "Name")
+FATHER_NAME_RULE = re.compile(r"Father\s*Name\s*[:\-]\s*(.+)", re.IGNORECASE)
+MOTHER_NAME_RULE = re.compile(r"Mother\s*Name\s*[:\-]\s*(.+)", re.IGNORECASE)
+PARENT_LABELS = r"(?:father name|mother name|parent|guardian)"
+
 def find_label_variants(name_label_variants):
     patterns = []
     for nl in name_label_variants:
@@ -141,69 +1102,124 @@ def find_label_variants(name_label_variants):
         patterns.append(re.compile(p, re.IGNORECASE))
     return patterns
 
-def extract_father_mother_names(page):
-    father = None
-    mother = None
-    pdict = page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)
-    for block in pdict.get("blocks", []):
-        for line in block.get("lines", []):
-            line_text = "".join([span["text"] for span in line.get("spans", [])]).strip()
-            if not line_text:
-                continue
-            m = re.search(r"Father\s*Name\s*[:\-]\s*(.+)", line_text, re.IGNORECASE)
-            if m:
-                father = m.group(1).strip()
-            m2 = re.search(r"Mother\s*Name\s*[:\-]\s*(.+)", line_text, re.IGNORECASE)
-            if m2:
-                mother = m2.group(1).strip()
-            if father and mother:
-                break
-        if father and mother:
-            break
-    return father, mother
-
-def extract_name_from_lines(page, name_label_patterns, father_name=None, mother_name=None):
-    pdict = page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)
-    flattened = []
-    for block in pdict.get("blocks", []):
-        for line in block.get("lines", []):
-            text_line = "".join([span["text"] for span in line.get("spans", [])]).strip()
-            if text_line:
-                ys = [span["bbox"][1] for span in line["spans"]]
-                y = min(ys) if ys else None
-                flattened.append((text_line, y))
-    flattened = sorted(flattened, key=lambda x: (x[1] if x[1] is not None else 0))
-    for idx, (ln_text, y) in enumerate(flattened):
-        for pat in name_label_patterns:
-            if re.search(rf"\b{pat.pattern.split(r'\s*[:\-]?')[0]}\b", ln_text, re.IGNORECASE):
-                m = pat.search(ln_text)
-                if m and m.group(1).strip():
-                    candidate = m.group(1).strip()
+LabelScan = namedtuple("LabelScan", ["father", "mother", "fields", "name_hits"])
+
+class LabelMatcher:
+    """
+    All page label patterns, compiled once per set of name label variants (see label_matcher()).
+    scan() finds every labelled field of a page in a single pass over its lines. Each line is
+    casefolded once and a pattern only runs when its label keyword occurs in the line, which
+    is much cheaper than trying every pattern (or one alternation of them all) on every line.
+    """
+
+    def __init__(self, name_label_variants):
+        self.name_label_variants = tuple(name_label_variants)
+        self.name_patterns = find_label_variants(self.name_label_variants)
+        self.name_heads = [re.compile(rf"\b{re.escape(nl)}\b", re.IGNORECASE) for nl in self.name_label_variants]
+        self.any_name_label = re.compile(
+            r"\b(?:" + "|".join(re.escape(nl) for nl in self.name_label_variants) + ")", re.IGNORECASE
+        )
+        # None where a substring test could miss an IGNORECASE match (it also equates 'i' and dotless 'ı')
+        self.name_keywords = [
+            nl.casefold() if nl.isascii() and "i" not in nl.casefold() else None
+            for nl in self.name_label_variants
+        ]
+
+    def scan(self, line_texts):
+        """
+        Returns a LabelScan of the page lines (in document order):
+        father/mother names, the rule fields of extract_fields_with_rules() and
+        name_hits, {line index: [indexes of the name labels on that line]}.
+        """
+        father = mother = None
+        fields = {}
+        name_hits = {}
+        for idx, line in enumerate(line_texts):
+            low = line.casefold()
+            if not (father and mother):
+                if "father" in low:
+                    m = FATHER_NAME_RULE.search(line)
+                    if m:
+                        father = m.group(1).strip()
+                if "mother" in low:
+                    m = MOTHER_NAME_RULE.search(line)
+                    if m:
+                        mother = m.group(1).strip()
+            if "Registration" not in fields and "reg" in low:
+                m = REGISTRATION_RULE.search(line)
+                if m:
+                    fields["Registration"] = m.group(1).strip()
+            if "SGPA" not in fields and "sgpa" in low:
+                m = SGPA_RULE.search(line)
+                if m and float(m.group(1)) <= 10:
+                    fields["SGPA"] = m.group(1)
+            if "Grade" not in fields and "grade" in low:
+                m = GRADE_RULE.search(line)
+                if m:
+                    fields["Grade"] = m.group(1).upper()
+            if "TotalMarks" not in fields and "total" in low:
+                m = TOTAL_MARKS_RULE.search(line)
+                if m:
+                    fields["TotalMarks"] = m.group(1).replace(",", "")
+                else:
+                    m = TOTAL_MARKS_WORDS_RULE.search(line)
+                    if m:
+                        value = words_to_number(m.group(1).strip())
+                        if value is not None:
+                            fields["TotalMarks"] = str(value)
+            hits = [i for i, keyword in enumerate(self.name_keywords)
+                    if (keyword is None or keyword in low) and self.name_heads[i].search(line)]
+            if hits:
+                name_hits[idx] = hits
+        return LabelScan(father, mother, fields, name_hits)
+
+@lru_cache(maxsize=64)
+def _label_matcher(name_label_variants):
+    return LabelMatcher(name_label_variants)
+
+def label_matcher(name_label_variants=DEFAULT_NAME_LABELS):
+    """Returns the shared LabelMatcher for a list of name label variants."""
+    return _label_matcher(tuple(name_label_variants))
+
+def extract_father_mother_names(layout, labels=None):
+    scan = layout.label_scan(labels or label_matcher())
+    return scan.father, scan.mother
+
+def extract_name_from_lines(layout, labels, father_name=None, mother_name=None):
+    name_hits = layout.label_scan(labels).name_hits
+    if not name_hits:
+        return None
+    order = layout.y_order
+    for pos, line_idx in enumerate(order):
+        ln_text = layout.lines[line_idx][0]
+        for i in name_hits.get(line_idx, ()):
+            m = labels.name_patterns[i].search(ln_text)
+            if m and m.group(1).strip():
+                candidate = m.group(1).strip()
+                if father_name and candidate.lower() == father_name.lower():
+                    return None
+                if mother_name and candidate.lower() == mother_name.lower():
+                    return None
+                return candidate
+            if pos + 1 < len(order):
+                next_text = layout.lines[order[pos+1]][0]
+                if next_text.strip():
+                    candidate = next_text.strip()
                     if father_name and candidate.lower() == father_name.lower():
                         return None
                     if mother_name and candidate.lower() == mother_name.lower():
                         return None
                     return candidate
-                if idx + 1 < len(flattened):
-                    next_text, _y2 = flattened[idx+1]
-                    if next_text.strip():
-                        candidate = next_text.strip()
-                        if father_name and candidate.lower() == father_name.lower():
-                            return None
-                        if mother_name and candidate.lower() == mother_name.lower():
-                            return None
-                        return candidate
     return None
 
-def extract_name_from_blocks(page, name_label_patterns, father_name=None, mother_name=None):
-    blocks = page.get_text("blocks", sort=True)
-    for (x0, y0, x1, y1, block_text, block_no, block_type) in blocks:
+def extract_name_from_blocks(layout, labels, father_name=None, mother_name=None):
+    for (x0, y0, x1, y1, block_text, block_no, block_type) in layout.blocks:
         if block_type != 0:
             continue
         text = block_text.strip()
-        if not text:
+        if not text or not labels.any_name_label.search(text):
             continue
-        for pat in name_label_patterns:
+        for pat in labels.name_patterns:
             m = pat.search(text)
             if m and m.group(1).strip():
                 candidate = m.group(1).strip().split("\n")[0].strip()
@@ -225,11 +1241,10 @@ def sanitize_model_name(model_name, page_text, father_name=None, mother_name=Non
     if mother_name and mn.lower() == mother_name.lower():
         return None
     lower = page_text.lower()
-    for label in ["father name", "mother name", "parent", "guardian"]:
-        p1 = rf"{label}\s*[:\-]?\s*{re.escape(mn.lower())}"
-        p2 = rf"{re.escape(mn.lower())}\s*[:\-]?\s*{label}"
-        if re.search(p1, lower) or re.search(p2, lower):
-            return None
+    # The name next to a parent/guardian label, on either side
+    name = re.escape(mn.lower())
+    if re.search(rf"{PARENT_LABELS}\s*[:\-]?\s*{name}|{name}\s*[:\-]?\s*{PARENT_LABELS}", lower):
+        return None
     parts = mn.split()
     if len(parts) < 2:
         return None
@@ -237,186 +1252,1021 @@ def sanitize_model_name(model_name, page_text, father_name=None, mother_name=Non
         return None
     return mn
 
-def select_final_name(page, model_name, name_label_patterns, father_name=None, mother_name=None, page_text=None):
-    name_cand = extract_name_from_lines(page, name_label_patterns, father_name, mother_name)
-    if name_cand:
-        return name_cand
-    name_cand = extract_name_from_blocks(page, name_label_patterns, father_name, mother_name)
-    if name_cand:
-        return name_cand
-    safe = sanitize_model_name(model_name, page_text, father_name, mother_name)
-    if safe:
-        return safe
-    return ""
+def select_final_name(layout, model_name, labels, father_name=None, mother_name=None):
+    name_cand = extract_name_from_lines(layout, labels, father_name, mother_name)
+    if name_cand:
+        return name_cand
+    name_cand = extract_name_from_blocks(layout, labels, father_name, mother_name)
+    if name_cand:
+        return name_cand
+    safe = sanitize_model_name(model_name, layout.text, father_name, mother_name)
+    if safe:
+        return safe
+    return ""
+
+# ---------------- Rule-based extraction ----------------
+
+RESULT_FIELDS = ["Name", "Registration", "TotalMarks", "SGPA", "Grade"]
+
+# Only unambiguous "label: value" forms are accepted, so a rule hit can be trusted
+# without asking the model. Each value must end where the number or code ends: a value
+# that goes on ('7.875', '1,234', '21BCE 1234') either matches whole or not at all, so
+# a cut-short value never replaces the model's answer.
+VALUE_END = r"(?!\d|[.,/]\d)"
+REGISTRATION_RULE = re.compile(
+    r"\bReg(?:istration|n|d)?\.?\s*(?:No|Number)?\.?\s*[:\-]\s*([A-Z0-9][A-Z0-9/\-]*\d[A-Z0-9/\-]*)"
+    r"(?![\w/\-]|[ \t]+[A-Z0-9]*\d)",
+    re.IGNORECASE
+)
+SGPA_RULE = re.compile(r"\bSGPA\s*[:\-]\s*(\d{1,2}(?:\.\d+)?)" + VALUE_END, re.IGNORECASE)
+GRADE_RULE = re.compile(r"\b(?:Overall\s+|Final\s+)?Grade\s*[:\-]\s*([A-F][+\-]?|O)(?![\w+\-])", re.IGNORECASE)
+TOTAL_MARKS_RULE = re.compile(
+    r"\bTotal\s+Marks\s+Obtained\s*[:\-]\s*(\d{1,3}(?:,\d{3})+|\d{1,4})" + VALUE_END, re.IGNORECASE
+)
+TOTAL_MARKS_WORDS_RULE = re.compile(
+    r"\bTotal\s+Marks\s+Obtained\s*\(?\s*in\s+words\s*\)?\s*[:\-]\s*([A-Za-z][A-Za-z\s\-]*)",
+    re.IGNORECASE
+)
+
+def extract_fields_with_rules(layout, labels, father_name=None, mother_name=None):
+    """
+    Deterministic extraction of the labelled result fields from the page lines.
+    Returns a dict holding only the fields that were found with confidence;
+    values are strings, the same as in a model response.
+    """
+    fields = dict(layout.label_scan(labels).fields)
+
+    name = extract_name_from_lines(layout, labels, father_name, mother_name)
+    if not name:
+        name = extract_name_from_blocks(layout, labels, father_name, mother_name)
+    if name:
+        fields["Name"] = name
+    return fields
+
+class StudentMerger:
+    """
+    Incremental form of merge_students(): entries can be added one at a time
+    and the merged records read at any point.
+    """
+
+    def __init__(self):
+        self.merged = {}
+        self.all_names = {}
+
+    def add(self, entry):
+        reg = entry.get("Registration", "").strip()
+        if entry.get("Name"):
+            self.all_names[entry["Registration"]] = entry["Name"]
+        if not reg:
+            return
+        if reg not in self.merged:
+            self.merged[reg] = entry.copy()
+        else:
+            for key in ["Name", "TotalMarks", "SGPA", "Grade"]:
+                if not self.merged[reg].get(key) and entry.get(key):
+                    self.merged[reg][key] = entry[key]
+
+    def records(self):
+        records = []
+        for reg, entry in self.merged.items():
+            entry = entry.copy()
+            if not entry.get("Name") and reg in self.all_names:
+                entry["Name"] = self.all_names[reg]
+            records.append(entry)
+        return records
+
+def merge_students(data):
+    merger = StudentMerger()
+    for entry in data:
+        merger.add(entry)
+    return merger.records()
+
+# ---------------- Columnar post-processing ----------------
+
+MERGE_FIELDS = ["Name", "TotalMarks", "SGPA", "Grade"]
+TEXT_FIELDS = ["Name", "Registration", "SGPA", "Grade"]
+
+def present_values(col):
+    """Mask of the values merge_students() treats as filled in (truthy and not missing)."""
+    present = col.notna()
+    present[present] = col[present].to_numpy(dtype=bool)
+    return present
+
+def strip_text(col):
+    """Strips whitespace from the string values of an object column; other values are kept."""
+    try:
+        stripped = col.str.strip()
+    except AttributeError:  # no string values at all
+        return col
+    return stripped.where(stripped.notna(), col)
+
+def merge_students_frame(df):
+    """
+    Columnar form of merge_students() for large result sets, with the same output.
+    Rows are grouped by the stripped Registration in order of first appearance; every
+    group keeps its first row and takes the first filled-in Name/TotalMarks/SGPA/Grade
+    of the group for fields the first row left empty. Rows without a registration
+    number are dropped.
+    """
+    df = df.astype(object)
+    if "Registration" not in df:
+        return df.iloc[0:0].reset_index(drop=True)
+    reg = df["Registration"].fillna("").astype(str).str.strip()
+    keep = (reg != "").to_numpy()
+    df = df[keep].reset_index(drop=True)
+
+    # Group number per row, numbered in order of first appearance
+    codes = pd.factorize(reg[keep])[0]
+    first_rows = np.unique(codes, return_index=True)[1]
+    merged = df.iloc[first_rows].reset_index(drop=True)
+    for key in MERGE_FIELDS:
+        if key not in df:
+            continue
+        present = present_values(df[key]).to_numpy()
+        # Row of the first filled-in value of every group that has one
+        filled_rows = pd.Series(np.flatnonzero(present)).groupby(codes[present], sort=False).first()
+        values = merged[key].to_numpy(copy=True)
+        values[filled_rows.index.to_numpy()] = df[key].to_numpy()[filled_rows.to_numpy()]
+        merged[key] = values
+    return merged
+
+def coerce_total_marks(col):
+    """
+    Vectorized clean_total_marks() returning a nullable integer column: plain digit
+    strings are converted in bulk and only the rest (number words) goes through
+    clean_total_marks(), once per distinct value.
+    """
+    col = col.astype(object)  # an empty or all-missing column may come in as float
+    result = pd.Series(None, index=col.index, dtype=object)
+    is_str = col.map(type) == str
+    numbers = col[~is_str & col.notna()]
+    # Like clean_total_marks(), NaN and infinity (json.loads() reads 1e999 as inf) are left empty
+    numbers = numbers[numbers.map(lambda v: isinstance(v, (int, float)) and math.isfinite(v))]
+    result[numbers.index] = numbers.astype(float).astype("int64").to_numpy()
+
+    text = col[is_str].str.strip().str.replace(r"[^\w\s]", "", regex=True).str.strip()
+    digits = text.str.fullmatch(r"[0-9]+").astype(bool)
+    result[text[digits].index] = text[digits].astype("int64").to_numpy()
+    words = col[is_str][~digits & (text != "")]
+    if not words.empty:
+        distinct = words.drop_duplicates()
+        lookup = pd.Series(distinct.map(clean_total_marks).to_numpy(), index=distinct.to_numpy())
+        result[words.index] = words.map(lookup).to_numpy()
+    return result.astype("Int64")
+
+def postprocess_results(df, numeric=False):
+    """
+    Post-processing of the page entries of a task as one DataFrame: strips the text fields,
+    merges rows by registration number (merge_students_frame) and, with `numeric`, coerces
+    TotalMarks and SGPA to numbers. Returns the RESULT_FIELDS columns.
+    """
+    df = df.astype(object)
+    for field in TEXT_FIELDS:
+        if field in df:
+            df[field] = strip_text(df[field])
+    df = merge_students_frame(df).reindex(columns=RESULT_FIELDS)
+    if numeric:
+        df["TotalMarks"] = coerce_total_marks(df["TotalMarks"])
+        # Always float, so results written in parts get the same column type in every part
+        df["SGPA"] = pd.to_numeric(df["SGPA"], errors="coerce").astype("float64")
+    return df
+
+def is_present(value):
+    """Scalar form of present_values(): whether merge_students() treats a value as filled in."""
+    return not pd.isna(value) and bool(value)
+
+def merge_result_chunks(chunks):
+    """
+    Merges page entries that arrive in chunks (lists of entry dicts, or DataFrames) the
+    way postprocess_results() merges them all at once. Each chunk is merged on its own;
+    a registration number -> row index of the students merged so far tells which of its
+    students are new (appended) and which were seen before (only their empty fields are
+    filled in), so every chunk costs time in its own size, not in the number of students.
+    Yields the merged students, in order of first appearance, as one DataFrame per chunk
+    that added students, once all chunks are read.
+    """
+    columns = {field: [] for field in RESULT_FIELDS}  # one array per chunk of new students
+    rows = {}  # stripped registration -> (array number, position) in columns
+    for chunk in chunks:
+        df = postprocess_results(pd.DataFrame(chunk, dtype=object))
+        if df.empty:
+            continue
+        regs = df["Registration"].fillna("").astype(str).str.strip().tolist()
+        seen = [rows.get(reg) for reg in regs]
+        new = np.array([where is None for where in seen])
+
+        for field in MERGE_FIELDS:
+            values = df[field].to_numpy(dtype=object)
+            present = present_values(df[field]).to_numpy()
+            for i in np.flatnonzero(~new & present):
+                part, pos = seen[i]
+                if not is_present(columns[field][part][pos]):
+                    columns[field][part][pos] = values[i]
+
+        if new.any():
+            part = len(columns["Registration"])
+            for field in RESULT_FIELDS:
+                columns[field].append(df[field].to_numpy(dtype=object)[new])
+            for pos, i in enumerate(np.flatnonzero(new)):
+                rows[regs[i]] = (part, pos)
+
+    for part in range(len(columns["Registration"])):
+        yield pd.DataFrame({field: columns[field][part] for field in RESULT_FIELDS})
+        for field in RESULT_FIELDS:
+            columns[field][part] = None  # Release each chunk once it has been handed out
+
+def postprocess_result_parts(parts, numeric=False):
+    """
+    Yields postprocess_results() of each merged part from merge_result_chunks(), taking the
+    parts out of the `parts` list as it goes, so every part is released once it is written.
+    """
+    parts.reverse()
+    while parts:
+        yield postprocess_results(parts.pop(), numeric)
+
+# ---------------- Result formats ----------------
+
+# Output format -> (file extension, MIME type)
+OUTPUT_FORMATS = {
+    "csv": (".csv", "text/csv"),
+    "csv.gz": (".csv.gz", "application/gzip"),
+    "csv.zst": (".csv.zst", "application/zstd"),
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+    "arrow": (".arrow", "application/vnd.apache.arrow.file"),
+}
+
+# Output format -> name shown in the upload form
+OUTPUT_FORMAT_LABELS = {
+    "csv": "CSV",
+    "csv.gz": "CSV, gzip-compressed",
+    "csv.zst": "CSV, zstd-compressed",
+    "parquet": "Parquet",
+    "arrow": "Arrow IPC (Feather)",
+}
+
+def output_format_error(output_format):
+    """Why results cannot be written in `output_format` here, or None if they can."""
+    if output_format not in OUTPUT_FORMATS:
+        return f"Unknown output format '{output_format}'. Use one of: {', '.join(OUTPUT_FORMATS)}"
+    if output_format in ("parquet", "arrow") and pa is None:
+        return f"The {output_format} output format needs pyarrow (pip install pyarrow)"
+    if output_format == "csv.zst" and zstandard is None:
+        return "The csv.zst output format needs zstandard (pip install zstandard)"
+    return None
+
+def result_schema():
+    """Arrow schema of the columnar outputs: TotalMarks and SGPA are typed, the rest are strings."""
+    return pa.schema([
+        ("Name", pa.string()),
+        ("Registration", pa.string()),
+        ("TotalMarks", pa.int64()),
+        ("SGPA", pa.float64()),
+        ("Grade", pa.string()),
+    ])
+
+def typed_results(df):
+    """Results with the column types of result_schema(); values that cannot be parsed become null."""
+    df = df.reindex(columns=RESULT_FIELDS).astype(object)
+    for field in ("Name", "Registration", "Grade"):
+        present = df[field].notna()
+        df[field] = df[field].where(~present, df[field][present].astype(str)).where(present, None)
+    df["TotalMarks"] = coerce_total_marks(df["TotalMarks"])
+    df["SGPA"] = pd.to_numeric(df["SGPA"], errors="coerce")
+    return df
+
+def result_row_groups(frames, row_group_size):
+    """
+    The rows of a DataFrame, or of several in turn, in slices of row_group_size rows (the
+    last one may be shorter; one empty slice for no rows). Small frames are joined up.
+    """
+    if isinstance(frames, pd.DataFrame):
+        frames = [frames]
+    pending, pending_rows, emitted = [], 0, False
+    empty = None  # Columns and types for a result without rows
+    for df in frames:
+        if empty is None:
+            empty = df.iloc[:0]
+        while len(df):
+            piece = df.iloc[:row_group_size - pending_rows]
+            df = df.iloc[len(piece):]
+            pending.append(piece)
+            pending_rows += len(piece)
+            if pending_rows == row_group_size:
+                yield pd.concat(pending, ignore_index=True) if len(pending) > 1 else pending[0]
+                pending, pending_rows, emitted = [], 0, True
+    if pending:
+        yield pd.concat(pending, ignore_index=True) if len(pending) > 1 else pending[0]
+    elif not emitted:
+        yield empty if empty is not None else pd.DataFrame(columns=RESULT_FIELDS)
+
+def write_results(results, path, output_format="csv", row_group_size=None):
+    """
+    Writes the results (a DataFrame, or an iterable of DataFrames such as the parts from
+    postprocess_result_parts()) in one of OUTPUT_FORMATS, one row group at a time: CSV
+    variants are appended slice by slice through the compressor, Parquet gets one row group
+    and Arrow IPC (Feather v2) one record batch per slice, so no whole table is built,
+    converted or compressed in memory. Returns the number of rows written.
+    """
+    if row_group_size is None:
+        row_group_size = app.config['RESULT_ROW_GROUP_SIZE']
+    row_group_size = max(1, int(row_group_size))
+    rows = 0
+
+    if output_format in ("parquet", "arrow"):
+        schema = result_schema()
+        writer = pq.ParquetWriter(path, schema) if output_format == "parquet" else pa.ipc.new_file(path, schema)
+        with writer:
+            for group in result_row_groups(results, row_group_size):
+                writer.write_table(pa.Table.from_pandas(typed_results(group), schema=schema, preserve_index=False))
+                rows += len(group)
+        return rows
+
+    if output_format == "csv.gz":
+        f = gzip.open(path, 'wt', encoding='utf-8', newline='')
+    elif output_format == "csv.zst":
+        f = io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(open(path, 'wb')), encoding='utf-8', newline='')
+    else:
+        f = open(path, 'w', encoding='utf-8', newline='')
+    with f:
+        for i, group in enumerate(result_row_groups(results, row_group_size)):
+            group.to_csv(f, index=False, header=i == 0)
+            rows += len(group)
+    return rows
+
+# ---------------- Partial results ----------------
+
+def iter_checkpoint(path):
+    """
+    Yields (record, end_offset) for the page entries of a partial results file, one at a
+    time. Only the unbroken run of pages 0, 1, 2, ... is read, so a line cut short by a
+    crash is ignored.
+    """
+    if not os.path.exists(path):
+        return
+    end_offset = 0
+    with open(path, "rb") as f:
+        for page, raw in enumerate(f):
+            if not raw.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(raw)
+            except ValueError:
+                break
+            if record.get("page") != page:
+                break
+            end_offset += len(raw)
+            yield record, end_offset
+
+def load_checkpoint(path):
+    """
+    Reads the page entries of a partial results file.
+    Returns (records, valid_bytes) where records are the parsed JSONL lines.
+    """
+    records = []
+    valid_bytes = 0
+    for record, valid_bytes in iter_checkpoint(path):
+        records.append(record)
+    return records, valid_bytes
+
+class PartialResultWriter:
+    """
+    Appends every finished page entry to a JSONL file as soon as it is ready and
+    keeps the registration-number merge up to date, so the results of a running
+    task can be read before the final output is written.
+    Pages are written in page order, so the file doubles as the task's checkpoint:
+    an existing file is loaded back and processing continues after its last page.
+    """
+
+    def __init__(self, task_id, path):
+        self.task_id = task_id
+        self.path = path
+        self.rules_only_pages = 0
+        self._merger = StudentMerger()
+        self._lock = threading.Lock()
+
+        pages = valid_bytes = 0
+        for record, valid_bytes in iter_checkpoint(path):
+            self._merger.add(record["entry"])
+            self.rules_only_pages += record.get("rules_only", False)
+            pages += 1
+        self.pages = self.resumed_pages = pages
+        self._file = open(path, "a", encoding="utf-8")
+        # Drop anything after the last complete page before appending
+        self._file.truncate(valid_bytes)
+
+    def add(self, page_num, entry, rules_only=False):
+        with self._lock:
+            self._file.write(json.dumps({"page": page_num, "entry": entry, "rules_only": rules_only}) + "\n")
+            self._file.flush()
+            self._merger.add(entry)
+            self.pages += 1
+            if rules_only:
+                self.rules_only_pages += 1
+
+    def records(self):
+        with self._lock:
+            return self._merger.records()
+
+    def entry_chunks(self, chunk_size=None):
+        """
+        Yields the page entries written so far in page order, read back from the file in
+        lists of at most `chunk_size` (RESULT_CHUNK_SIZE) entries.
+        """
+        chunk_size = chunk_size or app.config['RESULT_CHUNK_SIZE']
+        with self._lock:
+            self._file.flush()
+            end = os.path.getsize(self.path)
+        chunk = []
+        for record, offset in iter_checkpoint(self.path):
+            if offset > end:
+                break
+            chunk.append(record["entry"])
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def read_from(self, offset):
+        """Returns the JSONL lines written after byte `offset` and the offset to continue from."""
+        with self._lock:
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        return data, offset + len(data)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def partial_results_path(task_id):
+    return os.path.join(app.config['OUTPUT_FOLDER'], f"partial_{task_id}.jsonl")
+
+partial_writers = {}  # task_id -> PartialResultWriter of running tasks
+
+# ---------------- Main extraction function ----------------
+
+def build_prompt(page_text, page_num):
+    return f"""
+You are an assistant that extracts student result details from text.
+Extract the following fields only:
+- Name
+- Registration No
+- Total Marks Obtained
+- SGPA
+- Grade
+
+Important:
+- If a "Student Name" (or similar student name label) is present in the page, that must be used for the Name.
+- If it is NOT present, do NOT use "Father Name" or "Mother Name" as the student Name.
+- Return output as JSON ONLY in this format:
+{{
+    "Name": "",
+    "Registration": "",
+    "TotalMarks": "",
+    "SGPA": "",
+    "Grade": ""
+}}
+
+Text (page {page_num+1}):
+{page_text}
+"""
+
+def build_batch_prompt(pages):
+    """
+    Builds one prompt covering several pages. `pages` is a list of (page_num, page_text);
+    the model is asked for a JSON array with one record per page, keyed by page number.
+    """
+    page_sections = "\n".join(f"Text (page {page_num+1}):\n{page_text}" for page_num, page_text in pages)
+    return f"""
+You are an assistant that extracts student result details from text.
+The text below contains several pages. Each page belongs to one student.
+For every page, extract the following fields only:
+- Name
+- Registration No
+- Total Marks Obtained
+- SGPA
+- Grade
+
+Important:
+- If a "Student Name" (or similar student name label) is present in the page, that must be used for the Name.
+- If it is NOT present, do NOT use "Father Name" or "Mother Name" as the student Name.
+- Return output as a JSON array ONLY, with one object per page in this format:
+[
+    {{
+        "Page": 1,
+        "Name": "",
+        "Registration": "",
+        "TotalMarks": "",
+        "SGPA": "",
+        "Grade": ""
+    }}
+]
+
+{page_sections}
+"""
+
+def estimate_tokens(text):
+    # Rough estimate (~4 characters per token), used to size prompt batches and report prompt sizes
+    return len(text) // 4 + 1
+
+# Lines that label one of the result fields (or the parent names the prompt warns about)
+PROMPT_ANCHOR = re.compile(
+    r"\b(?:name|reg(?:istration|n|d)?|roll|enrol?lment|seat|total|marks|sgpa|cgpa|grade|result)\b",
+    re.IGNORECASE
+)
+
+def compact_page_text(layout, context_lines=PROMPT_CONTEXT_LINES):
+    """
+    Keeps only the lines within `context_lines` of a field label, in visual order and with
+    whitespace collapsed. Falls back to the whole (collapsed) page when no label is found.
+    """
+    lines = [re.sub(r"\s+", " ", text).strip() for text, _y in layout.lines_by_y]
+    anchors = [i for i, text in enumerate(lines) if PROMPT_ANCHOR.search(text)]
+    if not anchors:
+        return "\n".join(line for line in lines if line)
+    keep = set()
+    for i in anchors:
+        keep.update(range(max(0, i - context_lines), min(len(lines), i + context_lines + 1)))
+    return "\n".join(lines[i] for i in sorted(keep) if lines[i])
+
+def request_model_response(model_endpoint_url, prompt, what, stream_until=None, metrics=None):
+    """
+    Sends a prompt to the AI model and returns the raw response text.
+    Request failures are logged and result in None; `what` names the page(s) in log lines.
+    When MODEL_STREAMING is on, the response is streamed and cut off once stream_until(text) is true.
+    """
+    metrics = metrics or TaskMetrics()
+    metrics.count("model_requests")
+    try:
+        if not app.config['MODEL_STREAMING']:
+            stream_until = None
+        with metrics.timer("model_request"):
+            resp = model_client.generate(model_endpoint_url, prompt, stream_until=stream_until)
+
+        if resp.status_code != 200:
+            print(f"AI model request failed with status {resp.status_code}: {resp.text}")
+            metrics.count("model_errors")
+            return None
+
+        if isinstance(resp, StreamedGeneration):
+            first_token = f"{resp.first_token_seconds:.2f}s" if resp.first_token_seconds is not None else "n/a"
+            json_done = f"{resp.json_seconds:.2f}s" if resp.stopped_early else "not before the end"
+            print(f"AI model response streamed for {what} (first token {first_token}, JSON complete {json_done})")
+            return resp.response
+
+        model_raw = resp.json().get("response", "")
+        print(f"AI model response received for {what}")
+        return model_raw
+
+    except ModelUnavailableError:
+        # Fails the task; finished pages are kept in its checkpoint for /resume
+        metrics.count("model_errors")
+        raise
+    except requests.exceptions.RequestException as e:
+        print(f"Request error on {what}: {e}")
+        metrics.count("model_errors")
+        return None
+    except Exception as e:
+        print(f"Unexpected error on {what}: {e}")
+        metrics.count("model_errors")
+        return None
+
+def query_model(model_endpoint_url, prompt, page_num, metrics=None):
+    """
+    Sends one page prompt to the AI model and returns the parsed JSON dict.
+    Any request or parse failure is logged and results in an empty dict.
+    """
+    metrics = metrics or TaskMetrics()
+    model_raw = request_model_response(model_endpoint_url, prompt, f"page {page_num+1}",
+                                       stream_until=complete_result_object, metrics=metrics)
+    if model_raw is None:
+        return {}
+
+    try:
+        with metrics.timer("json_parse"):
+            m = re.search(r"\{.*\}", model_raw, re.DOTALL)
+            model_json = json.loads(m.group()) if m else None
+        if model_json is not None:
+            print(f"Successfully parsed JSON for page {page_num+1}: {model_json}")
+            return model_json
+        print(f"No JSON found in response for page {page_num+1}")
+        metrics.count("json_parse_errors")
+        return {}
+    except Exception as e:
+        print(f"JSON parse error on page {page_num+1}: {e}")
+        print(f"Raw response: {model_raw[:200]}...")
+        metrics.count("json_parse_errors")
+        return {}
+
+def query_model_cached(model_endpoint_url, prompt, page_num, cache_key, metrics=None):
+    model_json = query_model(model_endpoint_url, prompt, page_num, metrics)
+    # Empty results mean the request or the parse failed; those are retried next time
+    if model_json:
+        extraction_cache.put(cache_key, model_json)
+    return model_json
+
+def parse_batch_response(model_raw, page_nums):
+    """
+    Parses a JSON array answer to a batch prompt into {page_num: model_json}.
+    Records for pages that were not asked for, or that are not objects, are dropped.
+    """
+    results = {}
+    m = re.search(r"\[.*\]", model_raw, re.DOTALL)
+    if not m:
+        return results
+    try:
+        records = json.loads(m.group())
+    except Exception:
+        return results
+    if not isinstance(records, list):
+        return results
+    for record in records:
+        if not isinstance(record, dict):
+            continue
+        try:
+            page_num = int(record.pop("Page")) - 1
+        except (KeyError, TypeError, ValueError):
+            continue
+        if page_num in page_nums and page_num not in results:
+            results[page_num] = record
+    return results
+
+def query_model_batch(model_endpoint_url, batch, use_cache=True, metrics=None):
+    """
+    Resolves the futures of a batch of pages with one multi-page prompt.
+    `batch` is a list of (page_num, page_text, cache_key, future), with cache_key the key
+    of a batch answer. Pages missing from a malformed or incomplete answer are retried with
+    the single-page prompt, and that answer is cached under the single-page key.
+    """
+    metrics = metrics or TaskMetrics()
+    try:
+        answered = {}
+        if len(batch) > 1:
+            first, last = batch[0][0] + 1, batch[-1][0] + 1
+            prompt = build_batch_prompt([(page_num, page_text) for page_num, page_text, _key, _f in batch])
+            model_raw = request_model_response(model_endpoint_url, prompt, f"pages {first}-{last}",
+                                               stream_until=complete_result_array, metrics=metrics)
+            if model_raw is not None:
+                with metrics.timer("json_parse"):
+                    answered = parse_batch_response(model_raw, {page_num for page_num, *_rest in batch})
+                if len(answered) < len(batch):
+                    metrics.count("json_parse_errors")
+                print(f"Batch answer for pages {first}-{last} covered {len(answered)}/{len(batch)} pages")
+
+        for page_num, page_text, cache_key, future in batch:
+            model_json = answered.get(page_num)
+            if model_json is None:
+                prompt = build_prompt(page_text, page_num)
+                if use_cache:
+                    model_json = query_model_cached(model_endpoint_url, prompt, page_num,
+                                                    ExtractionCache.make_key(page_text), metrics)
+                else:
+                    model_json = query_model(model_endpoint_url, prompt, page_num, metrics)
+            elif use_cache:
+                extraction_cache.put(cache_key, model_json)
+            future.set_result(model_json)
+    except ModelUnavailableError as e:
+        for _page_num, _text, _key, future in batch:
+            if not future.done():
+                future.set_exception(e)
+    finally:
+        # Never leave a page waiting forever, whatever went wrong above
+        for _page_num, _text, _key, future in batch:
+            if not future.done():
+                future.set_result({})
+
+# ---------------- Page extraction ----------------
+
+def analyze_page(layout, labels, use_rules=True):
+    """Runs the regex-based page helpers; returns (father_name, mother_name, rule_json)."""
+    father_name, mother_name = extract_father_mother_names(layout, labels)
+    rule_json = {}
+    if use_rules:
+        rule_json = extract_fields_with_rules(layout, labels,
+                                              father_name=father_name, mother_name=mother_name)
+    return father_name, mother_name, rule_json
+
+def extract_page_chunk(pdf_path, start, stop, name_label_variants, use_rules=True):
+    """
+    Worker process entry point: opens the PDF itself and returns
+    (page_num, layout, father_name, mother_name, rule_json) for pages start..stop-1.
+    """
+    labels = label_matcher(name_label_variants)
+    doc = fitz.open(pdf_path)
+    try:
+        records = []
+        for page_num in range(start, stop):
+            layout = PageLayout(doc.load_page(page_num)).detach()
+            records.append((page_num, layout) + analyze_page(layout, labels, use_rules))
+        return records
+    finally:
+        doc.close()
+
+def iter_page_records(doc, pdf_path, name_label_variants, use_rules=True, workers=1, start_page=0):
+    """
+    Yields (page_num, layout, father_name, mother_name, rule_json) for every page from
+    start_page on, in page order.
+    With one worker the pages are read from the open `doc`, which must stay open while the
+    layouts are in use. PDFs longer than PAGE_WINDOW pages are instead read in windows of
+    that many pages, each from a freshly opened document that is closed afterwards (PyMuPDF
+    keeps what it parsed until the document is closed), with detached layouts, so memory
+    stays flat however long the PDF is. With more workers, page chunks are extracted by a
+    process pool; only a bounded number of chunks is outstanding so results stream back
+    without piling up in memory.
+    """
+    total_pages = len(doc)
+    if workers <= 1:
+        labels = label_matcher(name_label_variants)
+        window = app.config['PAGE_WINDOW']
+        if not window or total_pages <= window:
+            for page_num in range(start_page, total_pages):
+                layout = PageLayout(doc.load_page(page_num))
+                yield (page_num, layout) + analyze_page(layout, labels, use_rules)
+            return
+        for start in range(start_page, total_pages, window):
+            window_doc = fitz.open(pdf_path)
+            try:
+                for page_num in range(start, min(start + window, total_pages)):
+                    layout = PageLayout(window_doc.load_page(page_num)).detach()
+                    yield (page_num, layout) + analyze_page(layout, labels, use_rules)
+            finally:
+                window_doc.close()
+        return
+
+    chunk_size = app.config['PAGE_CHUNK_SIZE']
+    starts = iter(range(start_page, total_pages, chunk_size))
+    # "spawn" avoids forking a process that is already running request and model threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        chunks = deque()
+
+        def submit_next():
+            start = next(starts, None)
+            if start is not None:
+                chunks.append(pool.submit(extract_page_chunk, pdf_path, start,
+                                          min(start + chunk_size, total_pages),
+                                          name_label_variants, use_rules))
+
+        for _ in range(workers * 2):
+            submit_next()
+        while chunks:
+            records = chunks.popleft().result()
+            submit_next()
+            yield from records
+
+def completed_future(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+def submit_model_request(executor, model_endpoint_url, page_text, page_num, use_cache=True, metrics=None):
+    """
+    Returns a future for the page's model JSON, served from the extraction cache
+    when possible and otherwise by a model request on the executor.
+    """
+    metrics = metrics or TaskMetrics()
+    if not use_cache:
+        return executor.submit(query_model, model_endpoint_url, build_prompt(page_text, page_num), page_num,
+                               metrics)
+    cache_key = ExtractionCache.make_key(page_text)
+    cached_json = extraction_cache.get(cache_key)
+    if cached_json is not None:
+        print(f"Cache hit for page {page_num+1}")
+        metrics.count("cache_hits")
+        return completed_future(cached_json)
+    metrics.count("cache_misses")
+    return executor.submit(query_model_cached, model_endpoint_url, build_prompt(page_text, page_num),
+                           page_num, cache_key, metrics)
+
+class PromptBatcher:
+    """
+    Collects the pages that need the model and submits them as multi-page prompts of
+    at most batch_size pages or token_budget estimated prompt tokens.
+    add() returns a future per page, so callers can treat batched and single pages alike.
+    Cached answers are looked up under the key of the prompt this batch size uses.
+    """
 
-def merge_students(data):
-    merged = {}
-    for entry in data:
-        reg = entry.get("Registration", "").strip()
-        if not reg:
-            continue
-        if reg not in merged:
-            merged[reg] = entry.copy()
-        else:
-            for key in ["Name", "TotalMarks", "SGPA", "Grade"]:
-                if not merged[reg].get(key) and entry.get(key):
-                    merged[reg][key] = entry[key]
-    all_names = {e["Registration"]: e["Name"] for e in data if e.get("Name")}
-    for reg, entry in merged.items():
-        if not entry.get("Name") and reg in all_names:
-            entry["Name"] = all_names[reg]
-    return list(merged.values())
+    def __init__(self, executor, model_endpoint_url, batch_size, token_budget, use_cache=True, metrics=None):
+        self.executor = executor
+        self.model_endpoint_url = model_endpoint_url
+        self.batch_size = batch_size
+        self.token_budget = token_budget
+        self.use_cache = use_cache
+        self.metrics = metrics or TaskMetrics()
+        self.prompt_kind = "page" if batch_size <= 1 else f"batch{batch_size}"
+        self.batch = []
+        self.batch_tokens = 0
 
-# ---------------- Main extraction function ----------------
+    def add(self, page_num, page_text):
+        cache_key = None
+        if self.use_cache:
+            cache_key = ExtractionCache.make_key(page_text, prompt_kind=self.prompt_kind)
+            cached_json = extraction_cache.get(cache_key)
+            if cached_json is not None:
+                print(f"Cache hit for page {page_num+1}")
+                self.metrics.count("cache_hits")
+                return completed_future(cached_json)
+            self.metrics.count("cache_misses")
+
+        tokens = estimate_tokens(page_text)
+        if self.batch and self.batch_tokens + tokens > self.token_budget:
+            self.flush()
+        future = Future()
+        self.batch.append((page_num, page_text, cache_key, future))
+        self.batch_tokens += tokens
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+        return future
+
+    def holds(self, future):
+        return any(f is future for _page_num, _text, _key, f in self.batch)
+
+    def flush(self):
+        if not self.batch:
+            return
+        batch, self.batch, self.batch_tokens = self.batch, [], 0
+        self.executor.submit(query_model_batch, self.model_endpoint_url, batch, self.use_cache, self.metrics)
+
+def build_entry(layout, model_json, labels, father_name=None, mother_name=None, metrics=None):
+    metrics = metrics or TaskMetrics()
+    with metrics.timer("fallbacks"):
+        # clean + fallback for Total Marks
+        tm = clean_total_marks(model_json.get("TotalMarks", ""))
+        if tm is None:
+            tm = fallback_total_marks(layout)
+            if tm is not None:
+                metrics.count("total_marks_fallbacks")
+        if tm is not None:
+            model_json["TotalMarks"] = tm
+
+        model_name = model_json.get("Name", "").strip()
+        final_name = select_final_name(layout, model_name, labels,
+                                       father_name=father_name, mother_name=mother_name)
+        if final_name != model_name:
+            metrics.count("name_fallbacks")
 
-def extract_with_improved(pdf_path, model_endpoint_url, task_id, name_label_variants=None):
+    return {
+        "Name": final_name,
+        "Registration": model_json.get("Registration", "").strip(),
+        "TotalMarks": model_json.get("TotalMarks", ""),
+        "SGPA": model_json.get("SGPA", "").strip(),
+        "Grade": model_json.get("Grade", "").strip()
+    }
+
+def extract_with_improved(pdf_path, model_endpoint_url, task_id, name_label_variants=None, concurrency=None,
+                          batch_size=None, page_workers=None, output_format=None):
     if name_label_variants is None:
-        name_label_variants = ["Student Name", "Name of Student", "Name"]
-    name_label_patterns = find_label_variants(name_label_variants)
+        name_label_variants = list(DEFAULT_NAME_LABELS)
+    labels = label_matcher(name_label_variants)
+    # The endpoint's adaptive limit decides how many prompts are in flight; `concurrency`
+    # only caps this task, and by default the task can use all the limit allows
+    if concurrency is None:
+        concurrency = app.config['MODEL_MAX_CONCURRENCY']
+    concurrency = max(1, int(concurrency))
+    if batch_size is None:
+        batch_size = app.config['BATCH_SIZE']
+    batch_size = max(1, int(batch_size))
+    if page_workers is None:
+        page_workers = app.config['PAGE_WORKERS']
+    page_workers = max(1, int(page_workers))
+    if output_format is None:
+        output_format = app.config['OUTPUT_FORMAT']
+    use_cache = app.config['CACHE_ENABLED']
+    use_rules = app.config['RULES_FIRST']
+    compact_prompts = app.config['PROMPT_COMPACTION']
+    metrics = TaskMetrics()
+    task_metrics[task_id] = metrics
 
     try:
         processing_status[task_id] = {"status": "processing", "progress": 0, "message": "Starting PDF processing..."}
+        format_error = output_format_error(output_format)
+        if format_error:
+            raise ValueError(format_error)
         print(f"Starting processing for task {task_id}")
         print(f"PDF path: {pdf_path}")
         print(f"Model endpoint: {model_endpoint_url}")
+        print(f"LLM concurrency: adaptive, at most {concurrency} for this task, pages per prompt: {batch_size}")
         
         doc = fitz.open(pdf_path)
-        results = []
         total_pages = len(doc)
+        writer = PartialResultWriter(task_id, partial_results_path(task_id))
+        partial_writers[task_id] = writer
+        file_index.add(writer.path, task_id, "partial")
         start_time = time.time()
         print(f"PDF opened successfully. Total pages: {total_pages}")
+        if total_pages < app.config['PAGE_WORKERS_MIN_PAGES']:
+            page_workers = 1
+        page_workers = min(page_workers, os.cpu_count() or 1)
+        print(f"Page extraction processes: {page_workers}")
+        start_page = writer.resumed_pages
+        if start_page:
+            print(f"Resuming from checkpoint: {start_page}/{total_pages} pages already done")
+
+        # PyMuPDF is not thread-safe, so page work stays on this thread (or in
+        # worker processes) and only the model calls go to the thread pool.
+        # At most `concurrency` prompts (of `batch_size` pages each) are queued here;
+        # the endpoint's AdaptiveLimiter decides how many of them are sent at once.
+        # Pages are finished strictly in page order.
+        window = concurrency * batch_size
+        pending = deque()
+        page_tokens = 0  # Estimated tokens of the full text of pages sent to the model
+        prompt_tokens = 0  # Estimated tokens of the text actually sent
+
+        def finish_oldest():
+            page_num, layout, father_name, mother_name, rule_json, future = pending.popleft()
+            # Rule values win; the model only fills the fields the rules left empty
+            model_json = dict(future.result(), **rule_json)
+            rules_only = len(rule_json) == len(RESULT_FIELDS)
+            writer.add(page_num, build_entry(layout, model_json, labels,
+                                             father_name=father_name, mother_name=mother_name, metrics=metrics),
+                       rules_only=rules_only)
+            metrics.count("pages")
+            if rules_only:
+                metrics.count("rules_only_pages")
 
-        for page_num in range(total_pages):
-            page = doc.load_page(page_num)
+            done = page_num + 1
             elapsed = time.time() - start_time
-            avg = elapsed / (page_num + 1)
-            remaining = avg * (total_pages - (page_num + 1))
-            progress = int((page_num + 1) / total_pages * 100)
-            
+            avg = elapsed / (done - start_page)
+            remaining = avg * (total_pages - done)
             processing_status[task_id] = {
-                "status": "processing", 
-                "progress": progress, 
-                "message": f"Processing page {page_num+1}/{total_pages} — approx {remaining:.1f}s remaining"
+                "status": "processing",
+                "progress": int(done / total_pages * 100),
+                "message": f"Processing page {done}/{total_pages} — approx {remaining:.1f}s remaining"
             }
 
-            page_text = page.get_text("text", sort=True)
-            father_name, mother_name = extract_father_mother_names(page)
-
-            prompt = f"""
-You are an assistant that extracts student result details from text.
-Extract the following fields only:
-- Name
-- Registration No
-- Total Marks Obtained
-- SGPA
-- Grade
-
-Important:
-- If a "Student Name" (or similar student name label) is present in the page, that must be used for the Name.
-- If it is NOT present, do NOT use "Father Name" or "Mother Name" as the student Name.
-- Return output as JSON ONLY in this format:
-{{
-    "Name": "",
-    "Registration": "",
-    "TotalMarks": "",
-    "SGPA": "",
-    "Grade": ""
-}}
-
-Text (page {page_num+1}):
-{page_text}
-"""
-            print(f"Processing page {page_num+1}/{total_pages}...")
-            try:
-                resp = requests.post(
-                    model_endpoint_url,
-                    json={"model": "llama3", "prompt": prompt, "stream": False},
-                    timeout=30
-                )
-                
-                if resp.status_code != 200:
-                    print(f"AI model request failed with status {resp.status_code}: {resp.text}")
-                    model_json = {}
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            batcher = PromptBatcher(executor, model_endpoint_url, batch_size,
+                                    app.config['BATCH_TOKEN_BUDGET'], use_cache, metrics)
+            page_records = metrics.timed_iter("pdf_extraction", iter_page_records(
+                doc, pdf_path, name_label_variants, use_rules=use_rules, workers=page_workers, start_page=start_page
+            ))
+            for page_num, layout, father_name, mother_name, rule_json in page_records:
+                print(f"Processing page {page_num+1}/{total_pages}...")
+                if len(rule_json) == len(RESULT_FIELDS):
+                    print(f"All fields found by rules for page {page_num+1}, skipping AI model")
+                    future = completed_future({})
                 else:
-                    model_raw = resp.json().get("response", "")
-                    print(f"AI model response received for page {page_num+1}")
-                    
-                    try:
-                        m = re.search(r"\{.*\}", model_raw, re.DOTALL)
-                        if m:
-                            model_json = json.loads(m.group())
-                            print(f"Successfully parsed JSON for page {page_num+1}: {model_json}")
-                        else:
-                            print(f"No JSON found in response for page {page_num+1}")
-                            model_json = {}
-                    except Exception as e:
-                        print(f"JSON parse error on page {page_num+1}: {e}")
-                        print(f"Raw response: {model_raw[:200]}...")
-                        model_json = {}
-                        
-            except requests.exceptions.RequestException as e:
-                print(f"Request error on page {page_num+1}: {e}")
-                model_json = {}
-            except Exception as e:
-                print(f"Unexpected error on page {page_num+1}: {e}")
-                model_json = {}
-
-            # clean + fallback for Total Marks
-            tm = clean_total_marks(model_json.get("TotalMarks", ""))
-            if tm is None:
-                tm = fallback_total_marks(page, page_text)
-            if tm is not None:
-                model_json["TotalMarks"] = tm
-
-            model_name = model_json.get("Name", "").strip()
-            final_name = select_final_name(page, model_name, name_label_patterns,
-                                           father_name=father_name, mother_name=mother_name,
-                                           page_text=page_text)
-
-            entry = {
-                "Name": final_name,
-                "Registration": model_json.get("Registration", "").strip(),
-                "TotalMarks": model_json.get("TotalMarks", ""),
-                "SGPA": model_json.get("SGPA", "").strip(),
-                "Grade": model_json.get("Grade", "").strip()
-            }
-            results.append(entry)
-
+                    prompt_text = layout.text
+                    if compact_prompts:
+                        prompt_text = compact_page_text(layout, app.config['PROMPT_CONTEXT_LINES'])
+                    page_tokens += estimate_tokens(layout.text)
+                    prompt_tokens += estimate_tokens(prompt_text)
+                    if batch_size > 1:
+                        future = batcher.add(page_num, prompt_text)
+                    else:
+                        future = submit_model_request(executor, model_endpoint_url, prompt_text, page_num,
+                                                      use_cache, metrics)
+                pending.append((page_num, layout, father_name, mother_name, rule_json, future))
 
+                if len(pending) >= window:
+                    # The oldest page may still be waiting in a partly filled batch
+                    if batcher.holds(pending[0][-1]):
+                        batcher.flush()
+                    finish_oldest()
 
+            batcher.flush()
+            while pending:
+                finish_oldest()
 
         doc.close()
-        print(f"PDF processing completed. Total results collected: {len(results)}")
+        print(f"PDF processing completed. Total results collected: {writer.pages}")
+        print(f"Pages handled by rules without the AI model: {writer.rules_only_pages}/{total_pages}")
+        reduction = round(100 * (1 - prompt_tokens / page_tokens), 1) if page_tokens else 0.0
+        print(f"Prompt page text: ~{prompt_tokens} tokens sent for ~{page_tokens} tokens of page text "
+              f"({reduction}% reduction)")
         
         processing_status[task_id] = {"status": "processing", "progress": 90, "message": "Merging results..."}
         
-        cleaned = merge_students(results)
-        print(f"Results merged. Final count: {len(cleaned)}")
+        with metrics.timer("merge"):
+            parts = list(merge_result_chunks(writer.entry_chunks()))
+        print(f"Results merged. Final count: {sum(len(part) for part in parts)}")
         
-        # Save to CSV
-        df = pd.DataFrame(cleaned)
-        df = df[["Name", "Registration", "TotalMarks", "SGPA", "Grade"]]
-        output_filename = f"results_{task_id}.csv"
+        # Save the results file, one merged part at a time
+        output_filename = f"results_{task_id}{OUTPUT_FORMATS[output_format][0]}"
         output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
-        
-        print(f"Saving CSV file to: {output_path}")
-        print(f"DataFrame shape: {df.shape}")
-        print(f"DataFrame columns: {df.columns.tolist()}")
-        
-        df.to_csv(output_path, index=False)
+        with metrics.timer("csv_write"):
+            print(f"Saving {output_format} file to: {output_path}")
+            records_count = write_results(postprocess_result_parts(parts, app.config['NUMERIC_RESULTS']),
+                                          output_path, output_format)
+        file_index.add(output_path, task_id, "result")
         
         # Verify file was created
         if os.path.exists(output_path):
-            print(f"CSV file created successfully: {output_path}")
+            print(f"Results file created successfully: {output_path}")
         else:
-            print(f"ERROR: CSV file was not created: {output_path}")
+            print(f"ERROR: Results file was not created: {output_path}")
         
         processing_status[task_id] = {
             "status": "completed", 
             "progress": 100, 
             "message": "Processing completed successfully!",
             "output_file": output_filename,
-            "records_count": len(cleaned)
+            "output_format": output_format,
+            "records_count": records_count,
+            "rules_only_pages": writer.rules_only_pages,
+            "prompt_tokens": {"page_text": page_tokens, "sent": prompt_tokens, "reduction_percent": reduction},
+            "elapsed_seconds": round(time.time() - start_time, 2),
+            "metrics": metrics.snapshot()
         }
         
     except Exception as e:
@@ -427,113 +2277,1022 @@ Text (page {page_num+1}):
         processing_status[task_id] = {
             "status": "error", 
             "progress": 0, 
-            "message": f"Error processing PDF: {str(e)}"
+            "message": f"Error processing PDF: {str(e)}",
+            "metrics": metrics.snapshot()
         }
+    finally:
+        task_metrics.pop(task_id, None)
+        metrics_registry.task_finished(processing_status.get(task_id, {}).get("status", "error"))
+        writer = partial_writers.pop(task_id, None)
+        if writer is not None:
+            writer.close()
+            if processing_status.get(task_id, {}).get("status") == "completed":
+                file_index.discard(writer.path)
+
+# ---------------- Batch extraction ----------------
+
+def is_batch_upload(path):
+    """A batch upload is a folder of uploaded PDFs or a ZIP archive."""
+    return os.path.isdir(path) or allowed_file(path, BATCH_EXTENSIONS)
+
+def list_batch_files(batch_path):
+    """
+    Names of the PDFs in a batch upload, in processing order: the files of an upload
+    folder (saved with an index prefix, so sorting keeps the upload order), or the PDF
+    members of a ZIP archive in archive order, skipping folders and macOS resource forks.
+    """
+    if os.path.isdir(batch_path):
+        return sorted(name for name in os.listdir(batch_path) if allowed_file(name))
+    with zipfile.ZipFile(batch_path) as archive:
+        return [info.filename for info in archive.infolist()
+                if not info.is_dir() and allowed_file(info.filename)
+                and not info.filename.startswith('__MACOSX/')]
+
+@contextmanager
+def batch_file(batch_path, name, work_dir, index):
+    """
+    Path of one PDF of a batch upload. ZIP members are streamed into a temporary file
+    (named by index, never by the member path) that only exists while it is processed,
+    so an archive is never unpacked to disk all at once.
+    """
+    if os.path.isdir(batch_path):
+        yield os.path.join(batch_path, name)
+        return
+    path = os.path.join(work_dir, f"{index:04d}.pdf")
+    with zipfile.ZipFile(batch_path) as archive:
+        info = archive.getinfo(name)
+        if info.file_size > BATCH_MAX_MEMBER_SIZE:
+            raise ValueError(f"File is larger than {BATCH_MAX_MEMBER_SIZE // (1024 * 1024)}MB uncompressed")
+        with archive.open(info) as src, open(path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+    try:
+        yield path
+    finally:
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"Error removing extracted batch file: {e}")
+
+def batch_file_breakdown(files):
+    """Per-file progress of a batch, read from the status of each file's sub-task."""
+    breakdown = []
+    for entry in files:
+        status = processing_status.get(entry["task_id"], {"status": "queued", "progress": 0, "message": "Waiting..."})
+        breakdown.append({
+            "file": entry["file"],
+            "status": status["status"],
+            "progress": status.get("progress", 0),
+            "message": status.get("message", ""),
+            "records_count": status.get("records_count")
+        })
+    return breakdown
+
+def extract_batch(batch_path, model_endpoint_url, task_id, file_workers=None, output_format=None, **options):
+    """
+    Extracts every PDF of a batch upload under one task id. Each file runs through
+    extract_with_improved() as sub-task '<task_id>_<n>' (so it keeps its own checkpoint,
+    and a resumed batch skips the files already done), up to BATCH_FILE_WORKERS files at
+    a time. The per-file results (always CSV) are merged and deduplicated into one
+    results file in `output_format`.
+    """
+    if file_workers is None:
+        file_workers = app.config['BATCH_FILE_WORKERS']
+    file_workers = max(1, int(file_workers))
+    if output_format is None:
+        output_format = app.config['OUTPUT_FORMAT']
+    files = []
+
+    try:
+        processing_status[task_id] = {"status": "processing", "progress": 0, "message": "Reading batch upload..."}
+        format_error = output_format_error(output_format)
+        if format_error:
+            raise ValueError(format_error)
+        print(f"Starting batch processing for task {task_id}")
+        print(f"Batch path: {batch_path}")
+        names = list_batch_files(batch_path)
+        if not names:
+            raise ValueError("No PDF files found in the upload")
+        is_dir = os.path.isdir(batch_path)
+        files = [{"file": name.split('_', 1)[1] if is_dir else name, "name": name, "task_id": f"{task_id}_{i}"}
+                 for i, name in enumerate(names)]
+        print(f"Batch files: {len(files)}, processed {file_workers} at a time")
+        start_time = time.time()
+
+        def output_path(entry):
+            return os.path.join(app.config['OUTPUT_FOLDER'], f"results_{entry['task_id']}.csv")
+
+        def run_file(index, entry, work_dir):
+            if os.path.exists(output_path(entry)):
+                # Finished before the batch was interrupted
+                processing_status[entry["task_id"]] = {"status": "completed", "progress": 100,
+                                                       "message": "Already processed"}
+                return
+            try:
+                with batch_file(batch_path, entry["name"], work_dir, index) as pdf_path:
+                    extract_with_improved(pdf_path, model_endpoint_url, entry["task_id"], output_format="csv",
+                                          **options)
+            except Exception as e:
+                print(f"Error processing batch file {entry['file']}: {str(e)}")
+                processing_status[entry["task_id"]] = {"status": "error", "progress": 0,
+                                                       "message": f"Error processing PDF: {str(e)}"}
+
+        with tempfile.TemporaryDirectory(prefix=f"batch_{task_id}_") as work_dir, \
+                ThreadPoolExecutor(max_workers=file_workers) as executor:
+            futures = [executor.submit(run_file, i, entry, work_dir) for i, entry in enumerate(files)]
+            while True:
+                done, _ = wait(futures, timeout=0.5)
+                breakdown = batch_file_breakdown(files)
+                processing_status[task_id] = {
+                    "status": "processing",
+                    "progress": int(sum(f["progress"] for f in breakdown) / len(breakdown) * 0.9),
+                    "message": f"Processing files: {len(done)}/{len(files)} done",
+                    "files": breakdown
+                }
+                if len(done) == len(futures):
+                    break
+
+        breakdown = batch_file_breakdown(files)
+        completed = [entry for entry, f in zip(files, breakdown) if f["status"] == "completed"]
+        failed = [f["file"] for f in breakdown if f["status"] != "completed"]
+        if not completed:
+            raise ValueError("None of the files could be processed")
+
+        processing_status[task_id] = {"status": "processing", "progress": 90,
+                                      "message": "Merging results...", "files": breakdown}
+
+        def result_chunks():
+            # Per-file results are read in chunks and merged as they come, so only the merged
+            # students are held in memory, not every file's rows at once
+            for entry, f in zip(files, breakdown):
+                if f["status"] == "completed":
+                    f["records_count"] = 0
+                    for frame in pd.read_csv(output_path(entry), dtype=str, keep_default_na=False,
+                                             chunksize=app.config['RESULT_CHUNK_SIZE']):
+                        f["records_count"] += len(frame)
+                        yield frame
+
+        parts = list(merge_result_chunks(result_chunks()))
+        print(f"Batch results merged. Final count: {sum(len(part) for part in parts)}")
+
+        output_filename = f"results_{task_id}{OUTPUT_FORMATS[output_format][0]}"
+        batch_output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
+        records_count = write_results(postprocess_result_parts(parts, app.config['NUMERIC_RESULTS']),
+                                      batch_output_path, output_format)
+        file_index.add(batch_output_path, task_id, "result")
+        for entry in completed:
+            file_index.discard(output_path(entry))
+
+        message = f"Processing completed successfully! {len(completed)}/{len(files)} files processed."
+        if failed:
+            message += f" Failed: {', '.join(failed)}"
+        processing_status[task_id] = {
+            "status": "completed",
+            "progress": 100,
+            "message": message,
+            "output_file": output_filename,
+            "output_format": output_format,
+            "records_count": records_count,
+            "files": breakdown,
+            "failed_files": failed,
+            "elapsed_seconds": round(time.time() - start_time, 2)
+        }
+
+    except Exception as e:
+        print(f"CRITICAL ERROR in batch task {task_id}: {str(e)}")
+        import traceback
+        traceback.print_exc()
+
+        processing_status[task_id] = {
+            "status": "error",
+            "progress": 0,
+            "message": f"Error processing batch: {str(e)}",
+            "files": batch_file_breakdown(files)
+        }
+    finally:
+        for entry in files:
+            processing_status.pop(entry["task_id"], None)
+
+# ---------------- Job queue ----------------
+
+class JobQueue:
+    """
+    Persistent SQLite-backed queue of extraction jobs, run by a bounded pool of worker threads.
+    Jobs run by priority (higher first) and in arrival order within a priority. Running jobs
+    send a heartbeat, so jobs left behind by a stopped process are picked up again once their
+    heartbeat is older than stale_seconds. Like task statuses, finished jobs and their results
+    are evicted ttl seconds after they finish, and at most max_jobs finished jobs are kept.
+    """
+
+    EVICTION_INTERVAL = 60  # Seconds between evictions, run from _finish()
+
+    def __init__(self, path, workers=JOB_WORKERS, stale_seconds=JOB_STALE_SECONDS,
+                 ttl=TASK_STATUS_TTL, max_jobs=TASK_STATUS_MAX):
+        self.path = path
+        self.workers = workers
+        self.stale_seconds = stale_seconds
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self._last_eviction = 0.0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._running = set()
+        self._started = False
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, task_id TEXT UNIQUE NOT NULL, "
+            "pdf_path TEXT NOT NULL, model_endpoint TEXT NOT NULL, options TEXT NOT NULL, "
+            "priority INTEGER NOT NULL DEFAULT 0, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "result TEXT, created_at REAL NOT NULL, started_at REAL, finished_at REAL, heartbeat_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, priority, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished_at)")
+
+    def submit(self, task_id, pdf_path, model_endpoint, options=None, priority=0):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (task_id, pdf_path, model_endpoint, options, priority, status, created_at) "
+                "VALUES (?, ?, ?, ?, ?, 'queued', ?)",
+                (task_id, pdf_path, model_endpoint, json.dumps(options or {}), priority, time.time())
+            )
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def get(self, task_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE task_id = ?", (task_id,)).fetchone()
+        return self._to_job(row)
+
+    def position(self, task_id):
+        """1-based position of a queued job, or None if the job is not waiting."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, priority FROM jobs WHERE task_id = ? AND status = 'queued'", (task_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            ahead = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND (priority > ? OR (priority = ? AND id < ?))",
+                (row["priority"], row["priority"], row["id"])
+            ).fetchone()[0]
+        return ahead + 1
+
+    def active_task_ids(self, include_failed=True):
+        """Task ids of queued or running jobs, and of failed jobs that can be resumed."""
+        statuses = "('queued', 'running', 'error')" if include_failed else "('queued', 'running')"
+        with self._lock:
+            rows = self._conn.execute(f"SELECT task_id FROM jobs WHERE status IN {statuses}").fetchall()
+        return {row["task_id"] for row in rows}
+
+    def requeue(self, task_id):
+        """Puts a failed job back in the queue; returns False if the job is not in the error state."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = 'queued', result = NULL, finished_at = NULL "
+                "WHERE task_id = ? AND status = 'error'",
+                (task_id,)
+            )
+        if cur.rowcount:
+            with self._wakeup:
+                self._wakeup.notify()
+        return cur.rowcount > 0
+
+    def delete(self, task_id):
+        """Removes a finished job and its result; returns False if there is none."""
+        with self._lock:
+            cur = self._conn.execute(
+                "DELETE FROM jobs WHERE task_id = ? AND status IN ('completed', 'error')", (task_id,)
+            )
+        return cur.rowcount > 0
+
+    def evict(self):
+        """Removes finished jobs older than the TTL and the oldest finished jobs beyond max_jobs; returns how many."""
+        now = time.time()
+        self._last_eviction = now
+        with self._lock:
+            expired = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN ('completed', 'error') AND finished_at < ?", (now - self.ttl,)
+            ).rowcount
+            overflow = self._conn.execute(
+                "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE status IN ('completed', 'error') "
+                "ORDER BY finished_at DESC LIMIT -1 OFFSET ?)", (self.max_jobs,)
+            ).rowcount
+        return expired + overflow
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {row[0]: row[1] for row in rows}
+        counts["workers"] = self.workers
+        counts["running_here"] = len(self._running)
+        return counts
+
+    def start(self, runner):
+        """Starts the worker threads once; `runner(job)` processes a job and returns its final status dict."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for i in range(self.workers):
+            threading.Thread(target=self._worker_loop, args=(runner,), name=f"job-worker-{i}", daemon=True).start()
+        threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True).start()
+
+    def _to_job(self, row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["options"] = json.loads(job["options"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def _claim(self):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' OR (status = 'running' AND heartbeat_at < ?) "
+                    "ORDER BY status = 'running' DESC, priority DESC, id ASC LIMIT 1",
+                    (now - self.stale_seconds,)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, "
+                        "heartbeat_at = ? WHERE id = ?",
+                        (now, now, row["id"])
+                    )
+                    self._running.add(row["task_id"])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        job = self._to_job(row)
+        if job is not None:
+            job["status"] = "running"
+            job["attempts"] += 1
+        return job
+
+    def _finish(self, task_id, status, result):
+        with self._lock:
+            self._running.discard(task_id)
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, finished_at = ? WHERE task_id = ?",
+                (status, json.dumps(result), time.time(), task_id)
+            )
+        if time.time() - self._last_eviction > self.EVICTION_INTERVAL:
+            self.evict()
+
+    def _worker_loop(self, runner):
+        while True:
+            try:
+                job = self._claim()
+            except Exception as e:
+                print(f"Job queue error: {e}")
+                job = None
+            if job is None:
+                # Also wake up now and then for stale jobs and jobs queued by other processes
+                with self._wakeup:
+                    self._wakeup.wait(timeout=5)
+                continue
+
+            print(f"Starting job {job['task_id']} (attempt {job['attempts']})")
+            try:
+                result = runner(job)
+            except Exception as e:
+                print(f"Job {job['task_id']} failed: {e}")
+                result = {"status": "error", "progress": 0, "message": f"Error processing PDF: {str(e)}"}
+            status = "completed" if result.get("status") == "completed" else "error"
+            self._finish(job["task_id"], status, result)
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(max(1, self.stale_seconds / 4))
+            with self._lock:
+                running = list(self._running)
+                if running:
+                    self._conn.execute(
+                        f"UPDATE jobs SET heartbeat_at = ? WHERE task_id IN ({','.join('?' * len(running))})",
+                        [time.time()] + running
+                    )
+
+def run_job(job):
+    if is_batch_upload(job["pdf_path"]):
+        extract_batch(job["pdf_path"], job["model_endpoint"], job["task_id"], **job["options"])
+    else:
+        extract_with_improved(job["pdf_path"], job["model_endpoint"], job["task_id"], **job["options"])
+    file_index.task_finished(job["task_id"])
+    return processing_status.get(job["task_id"], {})
+
+job_queue = JobQueue(os.path.join(DATA_FOLDER, 'jobs.sqlite3'))
+
+# ---------------- File retention ----------------
+
+def task_owner(task_id):
+    """Task a file belongs to for retention: batch sub-tasks '<task_id>_<n>' belong to their batch."""
+    return task_id.split('_')[0] if task_id else None
+
+class FileIndex:
+    """
+    Index of the files the app writes (uploads, unfinished chunked uploads, result CSVs and
+    partial results), kept in SQLite with their task, size and age. The janitor and
+    /cleanup/<task_id> work from the index, so the upload and output folders are never
+    rescanned; files that were there before the index existed are adopted once.
+    """
+
+    KINDS = ("upload", "part", "result", "partial")
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, task_id TEXT, kind TEXT NOT NULL, size INTEGER NOT NULL DEFAULT 0, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL, expected_size INTEGER)"
+        )
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(files)")}
+        if "expected_size" not in columns:  # Index created before chunked uploads declared their size
+            self._conn.execute("ALTER TABLE files ADD COLUMN expected_size INTEGER")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_files_task ON files (task_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_files_updated ON files (updated_at)")
+
+    @staticmethod
+    def _size(path):
+        try:
+            if os.path.isdir(path):
+                return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def add(self, path, task_id, kind, expected_size=None):
+        """
+        Records a file (or upload folder), or refreshes its size and age if it is already known.
+        `expected_size` is the size a chunked upload declared when it started.
+        """
+        assert kind in self.KINDS
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO files (path, task_id, kind, size, created_at, updated_at, expected_size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (path) DO UPDATE SET task_id = excluded.task_id, kind = excluded.kind, "
+                "size = excluded.size, updated_at = excluded.updated_at, "
+                "expected_size = COALESCE(excluded.expected_size, expected_size)",
+                (path, task_id, kind, self._size(path), now, now, expected_size)
+            )
+
+    def expected_size(self, path):
+        """Size declared for a chunked upload, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT expected_size FROM files WHERE path = ?", (path,)).fetchone()
+        return row["expected_size"] if row else None
+
+    def move(self, path, new_path):
+        """Renames an indexed file on disk and in the index, keeping its kind."""
+        os.replace(path, new_path)
+        with self._lock:
+            self._conn.execute("UPDATE files SET path = ?, updated_at = ? WHERE path = ?",
+                               (new_path, time.time(), path))
+
+    def task_files(self, task_id, kind=None):
+        """Indexed paths of a task and its batch sub-tasks, optionally of one kind."""
+        query = "SELECT path FROM files WHERE (task_id = ? OR task_id LIKE ? ESCAPE '\\')"
+        params = [task_id, task_id.replace('_', '\\_') + '\\_%']
+        if kind is not None:
+            query += " AND kind = ?"
+            params.append(kind)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [row["path"] for row in rows]
+
+    def task_finished(self, task_id):
+        """Refreshes the sizes of a task's files once it has stopped writing them."""
+        now = time.time()
+        for path in self.task_files(task_id):
+            with self._lock:
+                self._conn.execute("UPDATE files SET size = ?, updated_at = ? WHERE path = ?",
+                                   (self._size(path), now, path))
+
+    def discard(self, path):
+        """Deletes a file or upload folder and its index entry; returns the bytes freed."""
+        size = self._size(path)
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            size = 0
+        except OSError as e:
+            print(f"Error removing {path}: {e}")
+            return 0
+        with self._lock:
+            self._conn.execute("DELETE FROM files WHERE path = ?", (path,))
+        return size
+
+    def remove_task(self, task_id):
+        """Deletes every indexed file of a task; returns how many were removed."""
+        paths = self.task_files(task_id)
+        for path in paths:
+            self.discard(path)
+        return len(paths)
+
+    def entries(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM files ORDER BY updated_at").fetchall()
+        return [dict(row) for row in rows]
+
+    def adopt(self, upload_folder, output_folder):
+        """
+        Indexes the files already in the upload and output folders, once per index: after
+        that every file the app writes is added as it is written.
+        """
+        with self._lock:
+            if self._conn.execute("PRAGMA user_version").fetchone()[0]:
+                return 0
+        adopted = 0
+        for folder in (upload_folder, output_folder):
+            for filename in os.listdir(folder):
+                match = re.match(r"(?:results_|partial_)?([0-9a-f-]{36}(?:_\d+)?)", filename)
+                task_id = match.group(1) if match else None
+                if folder == upload_folder:
+                    kind = "part" if filename.endswith('.part') else "upload"
+                elif filename.startswith('results_') and '_' not in (task_id or ''):
+                    kind = "result"
+                elif filename.startswith(('results_', 'partial_')):
+                    kind = "partial"
+                else:
+                    continue
+                path = os.path.join(folder, filename)
+                with self._lock:
+                    known = self._conn.execute("SELECT 1 FROM files WHERE path = ?", (path,)).fetchone()
+                if not known:
+                    self.add(path, task_id, kind)
+                    adopted += 1
+        with self._lock:
+            self._conn.execute("PRAGMA user_version = 1")
+        return adopted
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT kind, COUNT(*), COALESCE(SUM(size), 0) FROM files GROUP BY kind").fetchall()
+        return {"files": sum(row[1] for row in rows), "bytes": sum(row[2] for row in rows),
+                "by_kind": {row[0]: {"files": row[1], "bytes": row[2]} for row in rows}}
+
+class FileJanitor:
+    """
+    Background thread that applies the retention policies to the file index every interval
+    seconds: chunked uploads that stopped receiving chunks and uploads of finished tasks go
+    first, then files older than max_age, result CSVs beyond max_results and, while the
+    total size is above max_bytes, the oldest remaining files. Files of queued and running
+    jobs are never removed, and neither are the uploads and partial results of failed jobs
+    until they age out, since those jobs can still be resumed.
+    """
+
+    def __init__(self, index, queue, interval=JANITOR_INTERVAL, max_age=FILE_RETENTION_SECONDS,
+                 max_results=FILE_RETENTION_COUNT, max_bytes=FILE_RETENTION_BYTES, part_ttl=UPLOAD_PART_TTL):
+        self.index = index
+        self.queue = queue
+        self.interval = interval
+        self.max_age = max_age
+        self.max_results = max_results
+        self.max_bytes = max_bytes
+        self.part_ttl = part_ttl
+        self._lock = threading.Lock()
+        self._started = False
+        self.last_run = None
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._loop, name="file-janitor", daemon=True).start()
+
+    def _loop(self):
+        try:
+            adopted = self.index.adopt(app.config['UPLOAD_FOLDER'], app.config['OUTPUT_FOLDER'])
+            if adopted:
+                print(f"File janitor: indexed {adopted} existing files")
+        except Exception as e:
+            print(f"File janitor error: {e}")
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"File janitor error: {e}")
+            time.sleep(self.interval)
+
+    def run_once(self):
+        """One pass over the index; returns the number of files and bytes removed."""
+        now = time.time()
+        # Read the index before the queue: uploads are indexed after their job is queued
+        entries = self.index.entries()
+        running = {task_owner(t) for t in self.queue.active_task_ids(include_failed=False)}
+        resumable = {task_owner(t) for t in self.queue.active_task_ids()}
+        kept, removed = [], []
+        for entry in entries:
+            owner = task_owner(entry["task_id"])
+            if entry["kind"] == "part":
+                # Chunked uploads are not jobs yet; they only expire when no chunk arrives for a while
+                (removed if entry["updated_at"] < now - self.part_ttl else kept).append(entry)
+            elif owner in running:
+                continue
+            elif entry["kind"] == "upload" and owner not in resumable:
+                removed.append(entry)
+            elif entry["updated_at"] < now - self.max_age:
+                removed.append(entry)
+            else:
+                kept.append(entry)
+
+        # Entries are oldest first, so the newest results are at the end
+        results = [e for e in kept if e["kind"] == "result" and e["task_id"] == task_owner(e["task_id"])]
+        if len(results) > self.max_results:
+            removed.extend(results[:len(results) - self.max_results])
+        removed_paths = {e["path"] for e in removed}
+        kept = [e for e in kept if e["path"] not in removed_paths]
+
+        total = self.index.stats()["bytes"] - sum(e["size"] for e in removed)
+        for entry in kept:
+            if total <= self.max_bytes:
+                break
+            removed.append(entry)
+            total -= entry["size"]
+
+        freed = sum(self.index.discard(entry["path"]) for entry in removed)
+        self.last_run = now
+        if removed:
+            print(f"File janitor: removed {len(removed)} files ({freed / (1024 * 1024):.1f}MB)")
+        return len(removed), freed
+
+file_index = FileIndex(os.path.join(DATA_FOLDER, 'files.sqlite3'))
+file_janitor = FileJanitor(file_index, job_queue)
 
 # ---------------- Flask Routes ----------------
 
+def start_background_workers():
+    """Starts the job workers and the file janitor; calling it again does nothing."""
+    job_queue.start(run_job)
+    file_janitor.start()
+
+def start_serving_process(use_reloader):
+    """
+    Starts the background workers at startup, so queued and interrupted jobs run without
+    waiting for a request. Under the reloader only the child process (WERKZEUG_RUN_MAIN)
+    serves requests; the watcher process that restarts it never runs jobs.
+    """
+    if not use_reloader or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_workers()
+
+@app.before_request
+def start_job_workers():
+    # Safety net for servers that import the app without running __main__ (e.g. gunicorn)
+    start_background_workers()
+
 @app.route('/')
 def index():
-    return render_template('index.html')
+    # Formats whose library is not installed are listed but cannot be picked
+    output_formats = [{"value": output_format, "label": OUTPUT_FORMAT_LABELS[output_format],
+                       "error": output_format_error(output_format)} for output_format in OUTPUT_FORMATS]
+    return render_template('index.html', upload_chunk_size=UPLOAD_CHUNK_SIZE, output_formats=output_formats,
+                           default_output_format=app.config['OUTPUT_FORMAT'])
+
+def queue_upload(task_id, file_path):
+    """Queues the extraction of a saved upload with the options of the upload form."""
+    model_endpoint = request.form.get('model_endpoint', 'http://localhost:11434/api/generate')
+    options = {
+        'concurrency': request.form.get('concurrency', type=int),
+        'batch_size': request.form.get('batch_size', type=int),
+        'page_workers': request.form.get('page_workers', type=int),
+        'output_format': request.form.get('output_format')
+    }
+    format_error = output_format_error(options['output_format'] or app.config['OUTPUT_FORMAT'])
+    if format_error:
+        file_index.discard(file_path)
+        return jsonify({'error': format_error}), 400
+    if is_batch_upload(file_path):
+        options['file_workers'] = request.form.get('file_workers', type=int)
+    priority = request.form.get('priority', 0, type=int)
+    
+    # Queue the job for the background workers
+    processing_status[task_id] = {"status": "queued", "progress": 0, "message": "Waiting in queue..."}
+    job_queue.submit(task_id, file_path, model_endpoint,
+                     options={k: v for k, v in options.items() if v is not None}, priority=priority)
+    file_index.add(file_path, task_id, "upload")
+    
+    return jsonify({'task_id': task_id, 'message': 'File uploaded and queued for processing',
+                    'queue_position': job_queue.position(task_id)})
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
         return jsonify({'error': 'No file uploaded'}), 400
     
-    file = request.files['file']
-    model_endpoint = request.form.get('model_endpoint', 'http://localhost:11434/api/generate')
-    
-    if file.filename == '':
+    files = [f for f in request.files.getlist('file') if f.filename]
+    if not files:
         return jsonify({'error': 'No file selected'}), 400
     
-    if file and allowed_file(file.filename):
-        # Clean up old files before starting new upload
-        try:
-            # Clean old upload files
-            for filename in os.listdir(app.config['UPLOAD_FOLDER']):
-                if filename.endswith('.pdf'):
-                    try:
-                        os.remove(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                    except OSError as e:
-                        print(f"Error removing old upload file: {e}")
-            
-            # Keep only the last 5 CSV result files
-            csv_files = [f for f in os.listdir(app.config['OUTPUT_FOLDER']) if f.endswith('.csv')]
-            csv_files.sort(key=lambda x: os.path.getmtime(os.path.join(app.config['OUTPUT_FOLDER'], x)))
-            if len(csv_files) > 5:
-                for old_file in csv_files[:-5]:  # Remove all but the 5 most recent files
-                    try:
-                        os.remove(os.path.join(app.config['OUTPUT_FOLDER'], old_file))
-                    except OSError as e:
-                        print(f"Error removing old CSV file: {e}")
-        except Exception as e:
-            print(f"Error during cleanup: {e}")
-        
-        filename = secure_filename(file.filename)
+    is_archive = len(files) == 1 and allowed_file(files[0].filename, BATCH_EXTENSIONS)
+    if is_archive or all(allowed_file(f.filename) for f in files):
         task_id = str(uuid.uuid4())
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{task_id}_{filename}")
-        file.save(file_path)
-        
-        # Clear old status entries
-        old_tasks = [k for k in processing_status.keys()]
-        for old_task in old_tasks:
-            if old_task != task_id:
-                processing_status.pop(old_task, None)
-                download_status.pop(old_task, None)
-        
-        # Start processing in background thread
-        thread = threading.Thread(target=extract_with_improved, args=(file_path, model_endpoint, task_id))
-        thread.start()
+        if len(files) == 1:
+            # A single PDF, or a ZIP archive whose members are read while the batch is processed
+            filename = secure_filename(files[0].filename)
+            file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{task_id}_{filename}")
+            files[0].save(file_path)
+            if is_archive and not zipfile.is_zipfile(file_path):
+                os.remove(file_path)
+                return jsonify({'error': 'Invalid ZIP archive.'}), 400
+        else:
+            # Several PDFs go into one folder, prefixed with their position to keep the upload order
+            file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{task_id}_batch")
+            os.makedirs(file_path)
+            for i, file in enumerate(files):
+                file.save(os.path.join(file_path, f"{i:04d}_{secure_filename(file.filename)}"))
         
-        return jsonify({'task_id': task_id, 'message': 'File uploaded and processing started'})
+        return queue_upload(task_id, file_path)
     
-    return jsonify({'error': 'Invalid file type. Please upload a PDF file.'}), 400
+    return jsonify({'error': 'Invalid file type. Please upload PDF files or a ZIP archive.'}), 400
 
-@app.route('/status/<task_id>')
-def get_status(task_id):
+def upload_part_path(task_id):
+    """Path of the unfinished chunked upload `task_id`, or None if there is none."""
+    if not re.fullmatch(r"[0-9a-f-]{36}", task_id):
+        return None
+    paths = [p for p in file_index.task_files(task_id, kind="part") if p.endswith('.part')]
+    return paths[0] if paths else None
+
+@app.route('/upload/start', methods=['POST'])
+def start_chunked_upload():
+    """
+    Starts a chunked upload of one large PDF or ZIP archive (form fields `filename` and `size`).
+    The file is then sent in pieces of at most `chunk_size` bytes to /upload/<task_id>/chunk
+    and queued with /upload/<task_id>/complete. Returns the task id and the chunk size.
+    """
+    filename = secure_filename(request.form.get('filename', ''))
+    size = request.form.get('size', type=int)
+    if not (allowed_file(filename) or allowed_file(filename, BATCH_EXTENSIONS)):
+        return jsonify({'error': 'Invalid file type. Please upload PDF files or a ZIP archive.'}), 400
+    if size is None or size <= 0:
+        return jsonify({'error': 'Missing file size'}), 400
+    if size > app.config['LARGE_UPLOAD_MAX_SIZE']:
+        return jsonify({'error': 'File too large'}), 413
+    
+    task_id = str(uuid.uuid4())
+    part_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{task_id}_{filename}.part")
+    open(part_path, 'wb').close()
+    file_index.add(part_path, task_id, "part", expected_size=size)
+    return jsonify({'task_id': task_id, 'chunk_size': UPLOAD_CHUNK_SIZE})
+
+@app.route('/upload/<task_id>/chunk', methods=['POST'])
+def upload_chunk(task_id):
+    """
+    Appends the request body to a chunked upload. `?offset=N` must equal the bytes received
+    so far; otherwise 409 is returned with `received`, so an interrupted upload can continue
+    from there. The body is streamed to disk and never held in memory.
+    """
+    part_path = upload_part_path(task_id)
+    if part_path is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    offset = request.args.get('offset', 0, type=int)
+    with open(part_path, 'ab') as f:
+        received = f.tell()
+        if offset != received:
+            return jsonify({'error': 'Unexpected offset', 'received': received}), 409
+        try:
+            shutil.copyfileobj(request.stream, f, 1024 * 1024)
+        except Exception:
+            # Drop a chunk that was cut short so the client can send it again
+            f.truncate(offset)
+            raise
+        received = f.tell()
+        expected = file_index.expected_size(part_path)
+        if received > app.config['LARGE_UPLOAD_MAX_SIZE'] or (expected is not None and received > expected):
+            f.truncate(offset)
+            return jsonify({'error': 'File too large', 'received': offset}), 413
+    # Keeps the upload from expiring while chunks are still arriving
+    file_index.add(part_path, task_id, "part")
+    return jsonify({'task_id': task_id, 'received': received})
+
+@app.route('/upload/<task_id>/complete', methods=['POST'])
+def complete_chunked_upload(task_id):
+    """
+    Finishes a chunked upload and queues it; takes the same form fields as /upload.
+    Returns 409 with `received` while fewer bytes than the declared size have arrived.
+    """
+    part_path = upload_part_path(task_id)
+    if part_path is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    received = os.path.getsize(part_path)
+    expected = file_index.expected_size(part_path)
+    if expected is not None and received != expected:
+        return jsonify({'error': 'Upload incomplete', 'received': received, 'size': expected}), 409
+    file_path = part_path[:-len('.part')]
+    # Stays a part (which the janitor leaves alone for a while) until its job is queued
+    file_index.move(part_path, file_path)
+    if is_batch_upload(file_path) and not zipfile.is_zipfile(file_path):
+        file_index.discard(file_path)
+        return jsonify({'error': 'Invalid ZIP archive.'}), 400
+    return queue_upload(task_id, file_path)
+
+def task_status(task_id):
+    """Current status of a task (live, or from the job queue), or None if the task is unknown."""
+    job = job_queue.get(task_id)
     if task_id in processing_status:
-        return jsonify(processing_status[task_id])
+        status = dict(processing_status[task_id])
+    elif job and job['result']:
+        status = dict(job['result'])
+    elif job:
+        message = "Waiting in queue..." if job['status'] == 'queued' else "Processing started..."
+        status = {"status": job['status'], "progress": 0, "message": message}
     else:
+        return None
+
+    if job and job['status'] == 'queued':
+        position = job_queue.position(task_id)
+        status['queue_position'] = position
+        status['message'] = f"Waiting in queue (position {position})..."
+    if task_id in task_metrics:
+        status['metrics'] = task_metrics[task_id].snapshot()
+    return status
+
+@app.route('/status/<task_id>')
+def get_status(task_id):
+    status = task_status(task_id)
+    if status is None:
+        return jsonify({'error': 'Task not found'}), 404
+    return jsonify(status)
+
+@app.route('/events/<task_id>')
+def status_events(task_id):
+    """
+    Server-Sent Events stream of a task's status: a 'status' event (the same JSON as
+    /status) whenever it changes, at most one per STATUS_EVENT_INTERVAL so fast page
+    updates are coalesced. The stream ends after the completed or error status.
+    """
+    if task_status(task_id) is None:
+        return jsonify({'error': 'Task not found'}), 404
+
+    def stream():
+        last_data = None
+        last_sent = time.time()
+        version = status_updates.version(task_id)
+        while True:
+            status = task_status(task_id)
+            if status is None:
+                yield f"event: error\ndata: {json.dumps({'error': 'Task not found'})}\n\n"
+                return
+            data = json.dumps(status)
+            if data != last_data:
+                yield f"event: status\ndata: {data}\n\n"
+                last_data = data
+                last_sent = time.time()
+                if status['status'] in ('completed', 'error'):
+                    return
+            elif time.time() - last_sent >= STATUS_EVENT_KEEPALIVE:
+                yield ": keep-alive\n\n"
+                last_sent = time.time()
+            time.sleep(STATUS_EVENT_INTERVAL)
+            # Updates made by other server processes, and queue positions moving, do not wake
+            # this stream, so the status is re-read at least every second
+            version = status_updates.wait(task_id, version, 1)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/partial/<task_id>')
+def get_partial_results(task_id):
+    """
+    Results of a running task so far. Returns the merged records as JSON, or as CSV with
+    ?format=csv. ?format=jsonl&offset=N returns the raw page entries written after byte
+    offset N, with the offset to continue from in the X-Next-Offset header.
+    """
+    writer = partial_writers.get(task_id)
+    if writer is None:
+        status = processing_status.get(task_id, {})
+        return jsonify({
+            'error': 'No partial results: task is not running',
+            'status': status.get('status'),
+            'output_file': status.get('output_file')
+        }), 404
+
+    result_format = request.args.get('format', 'json')
+    if result_format == 'jsonl':
+        data, next_offset = writer.read_from(request.args.get('offset', 0, type=int))
+        return Response(data, mimetype='application/x-ndjson', headers={'X-Next-Offset': str(next_offset)})
+
+    records = writer.records()
+    if result_format == 'csv':
+        df = pd.DataFrame(records, columns=RESULT_FIELDS)
+        return Response(df.to_csv(index=False), mimetype='text/csv',
+                        headers={'Content-Disposition': f'attachment; filename=partial_{task_id}.csv'})
+
+    return jsonify({
+        'task_id': task_id,
+        'pages_done': writer.pages,
+        'records_count': len(records),
+        'records': records
+    })
+
+@app.route('/resume/<task_id>', methods=['POST'])
+def resume_task(task_id):
+    """Queues a failed task again; it continues after the last page in its checkpoint."""
+    job = job_queue.get(task_id)
+    if job is None:
         return jsonify({'error': 'Task not found'}), 404
+    if job['status'] != 'error':
+        return jsonify({'error': f"Task cannot be resumed while it is {job['status']}"}), 400
+    if not os.path.exists(job['pdf_path']):
+        return jsonify({'error': 'Uploaded PDF is no longer available'}), 410
+
+    if not job_queue.requeue(task_id):
+        return jsonify({'error': 'Task cannot be resumed right now'}), 409
+    checkpoint, _valid_bytes = load_checkpoint(partial_results_path(task_id))
+    processing_status[task_id] = {"status": "queued", "progress": 0, "message": "Waiting in queue..."}
+    return jsonify({
+        'task_id': task_id,
+        'message': 'Task queued to resume',
+        'pages_done': len(checkpoint),
+        'queue_position': job_queue.position(task_id)
+    })
+
+def file_etag(path):
+    """Strong ETag of a result file, from its size and modification time (results are never modified in place)."""
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+def gzip_file_chunks(path, chunk_size=256 * 1024):
+    """Gzip-compresses a file while it is being sent, one chunk at a time."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+    yield compressor.flush()
 
 @app.route('/download/<filename>')
 def download_file(filename):
-    max_retries = 5
-    retry_delay = 1  # seconds
-    
-    task_id = filename.replace('results_', '').replace('.csv', '')
-    if task_id:
-        download_status[task_id] = 'pending'
-    
-    for attempt in range(max_retries):
-        try:
-            file_path = os.path.join(app.config['OUTPUT_FOLDER'], filename)
-            print(f"Attempting to download file (attempt {attempt + 1}/{max_retries}): {file_path}")
-            
-            if not os.path.exists(file_path):
-                if attempt < max_retries - 1:
-                    print(f"File not found, waiting {retry_delay} seconds before retry...")
-                    time.sleep(retry_delay)
-                    continue
-                
-                print(f"File not found after {max_retries} attempts: {file_path}")
-                output_files = os.listdir(app.config['OUTPUT_FOLDER'])
-                print(f"Available files in outputs: {output_files}")
-                if task_id:
-                    download_status[task_id] = 'failed'
-                return jsonify({'error': f'File not found: {filename}. Available files: {output_files}'}), 404
-            
-            return send_file(file_path, as_attachment=True)
-        except Exception as e:
-            if attempt < max_retries - 1:
-                print(f"Download attempt {attempt + 1} failed: {str(e)}, retrying...")
-                time.sleep(retry_delay)
-                continue
-            print(f"Download failed after {max_retries} attempts: {str(e)}")
-            if task_id:
-                download_status[task_id] = 'failed'
-            return jsonify({'error': f'Download failed: {str(e)}'}), 500
+    """
+    Sends a result file. While its task is still queued or running the answer is 202 with
+    Retry-After instead of waiting for the file, so no request holds a worker thread.
+    Finished results support ETag / If-None-Match and range requests, and results of at
+    least DOWNLOAD_GZIP_MIN_SIZE bytes are gzip-compressed for clients that accept it.
+    """
+    filename = secure_filename(filename)
+    match = re.fullmatch(r"results_([0-9a-f-]{36})(\.[a-z.]+)", filename)
+    task_id = match.group(1) if match else None
+    mimetype = next((m for ext, m in OUTPUT_FORMATS.values() if match and match.group(2) == ext), None)
+    # Absolute, since send_file would resolve a relative path against the app folder, not the working directory
+    file_path = os.path.abspath(os.path.join(app.config['OUTPUT_FOLDER'], filename))
+
+    if not os.path.exists(file_path):
+        status = task_status(task_id) if task_id else None
+        if status and status.get('status') not in ('completed', 'error'):
+            response = jsonify({'message': 'Results are not ready yet', 'status': status.get('status'),
+                                'progress': status.get('progress', 0)})
+            response.status_code = 202
+            response.headers['Retry-After'] = str(DOWNLOAD_RETRY_AFTER)
+            return response
+        if task_id and status:
+            download_status[task_id] = 'failed'
+        if status and status.get('status') == 'error':
+            return jsonify({'error': f"Processing failed: {status.get('message', '')}"}), 404
+        print(f"File not found: {file_path}")
+        return jsonify({'error': f'File not found: {filename}'}), 404
+
+    try:
+        if task_id:
+            download_status[task_id] = 'pending'
+        etag = file_etag(file_path)
+        gzip_min_size = app.config['DOWNLOAD_GZIP_MIN_SIZE']
+        # Only plain CSV is compressed on the way; the other formats are compressed already
+        compress = (gzip_min_size is not None and filename.endswith('.csv') and 'Range' not in request.headers
+                    and 'gzip' in request.accept_encodings and os.path.getsize(file_path) >= gzip_min_size)
+        if not compress:
+            response = send_file(file_path, mimetype=mimetype, as_attachment=True, conditional=True, etag=etag)
+        else:
+            # The compressed body is a different representation, so it gets its own ETag
+            etag = f"{etag}-gzip"
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                response = Response(gzip_file_chunks(file_path), mimetype='text/csv')
+                response.headers['Content-Encoding'] = 'gzip'
+                response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+            response.set_etag(etag)
+        if gzip_min_size is not None and filename.endswith('.csv'):
+            response.vary.add('Accept-Encoding')
+        return response
+    except Exception as e:
+        print(f"Download failed: {str(e)}")
+        if task_id:
+            download_status[task_id] = 'failed'
+        return jsonify({'error': f'Download failed: {str(e)}'}), 500
 
 @app.route('/confirm-download/<task_id>')
 def confirm_download(task_id):
@@ -552,10 +3311,20 @@ def debug_info():
         "output_files": os.listdir(app.config['OUTPUT_FOLDER']) if os.path.exists(app.config['OUTPUT_FOLDER']) else [],
         "upload_files": os.listdir(app.config['UPLOAD_FOLDER']) if os.path.exists(app.config['UPLOAD_FOLDER']) else [],
         "output_folder": app.config['OUTPUT_FOLDER'],
-        "upload_folder": app.config['UPLOAD_FOLDER']
+        "upload_folder": app.config['UPLOAD_FOLDER'],
+        "extraction_cache": extraction_cache.stats(),
+        "job_queue": job_queue.stats(),
+        "task_store": task_store.stats(),
+        "files": file_index.stats(),
+        "model_client": model_client.stats()
     }
     return jsonify(debug_info)
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/test-csv')
 def create_test_csv():
     """Create a test CSV file to verify download functionality"""
@@ -610,11 +3379,7 @@ Return output as JSON ONLY in this format:
 Text: Student Name: John Doe, Registration: 12345, Total Marks: 85, SGPA: 8.5, Grade: A
 """
         
-        resp = requests.post(
-            model_endpoint,
-            json={"model": "llama3", "prompt": test_prompt, "stream": False},
-            timeout=30
-        )
+        resp = model_client.generate(model_endpoint, test_prompt, retries=0, wait_for_breaker=False)
         
         if resp.status_code == 200:
             result = resp.json()
@@ -647,28 +3412,13 @@ def cleanup_files(task_id):
         if task_id not in download_status or download_status[task_id] != 'completed':
             return jsonify({'error': 'Download not confirmed, skipping cleanup'}), 400
 
-        # Clean up uploaded file
-        for filename in os.listdir(app.config['UPLOAD_FOLDER']):
-            if filename.startswith(task_id):
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                try:
-                    os.remove(file_path)
-                except OSError as e:
-                    print(f"Error removing upload file: {e}")
-        
-        # Clean up output file
-        output_file = processing_status[task_id].get('output_file')
-        if output_file:
-            output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_file)
-            try:
-                if os.path.exists(output_path):
-                    os.remove(output_path)
-            except OSError as e:
-                print(f"Error removing output file: {e}")
+        # Clean up the task's upload, results and partial results
+        file_index.remove_task(task_id)
         
-        # Clean up status entries
+        # Clean up status entries and the job with its stored result, so /status returns 404
         del processing_status[task_id]
         del download_status[task_id]
+        job_queue.delete(task_id)
         
         return jsonify({'message': 'Files cleaned up successfully'})
     except Exception as e:
@@ -676,4 +3426,5 @@ def cleanup_files(task_id):
         return jsonify({'error': f'Cleanup failed: {str(e)}'}), 500
 
 if __name__ == '__main__':
+    start_serving_process(use_reloader=True)
     app.run(debug=True, host='0.0.0.0', port=5000)
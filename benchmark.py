@@ -0,0 +1,648 @@
+#!/usr/bin/env python3
+"""
+PDF Result Extractor - Benchmark
+Generates a synthetic N-page result PDF, serves a local mock /api/generate model
+endpoint and times extract_with_improved() for one or more scenarios.
+
+Examples:
+    python benchmark.py --pages 200 --latency 0.2
+    python benchmark.py --scenario seq:concurrency=1 --scenario batched:batch_size=4 --output bench.json
+    python benchmark.py --labels --pages 500
+    python benchmark.py --memory 100,1000,10000 --latency 0 --rules
+
+Each scenario runs in a fresh child process (inside a temporary working directory),
+so peak RSS is measured per scenario. The JSON report can be compared across commits.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_SCENARIOS = [
+    "sequential:concurrency=1",
+    "concurrent:concurrency=4",
+    "batched:concurrency=4,batch_size=4",
+]
+
+# ---------------- Synthetic PDF ----------------
+
+FIRST_NAMES = ["Aarav", "Diya", "Ishaan", "Ananya", "Kabir", "Meera", "Rohan", "Saanvi", "Vihaan", "Zara"]
+LAST_NAMES = ["Sharma", "Verma", "Singh", "Patel", "Rao", "Iyer", "Gupta", "Das", "Nair", "Khan"]
+SUBJECTS = ["Mathematics", "Physics", "Chemistry", "English", "Programming", "Electronics", "Mechanics", "Drawing"]
+ONES = ["", "One", "Two", "Three", "Four", "Five", "Six", "Seven", "Eight", "Nine", "Ten", "Eleven", "Twelve",
+        "Thirteen", "Fourteen", "Fifteen", "Sixteen", "Seventeen", "Eighteen", "Nineteen"]
+TENS = ["", "", "Twenty", "Thirty", "Forty", "Fifty", "Sixty", "Seventy", "Eighty", "Ninety"]
+
+
+def number_to_words(n):
+    """Spells out 0 < n < 1000, e.g. 415 -> 'Four Hundred Fifteen'."""
+    words = []
+    if n >= 100:
+        words += [ONES[n // 100], "Hundred"]
+        n %= 100
+    if n >= 20:
+        words.append(TENS[n // 10])
+        n %= 10
+    if n:
+        words.append(ONES[n])
+    return " ".join(words)
+
+
+def make_students(pages, seed=42):
+    rng = random.Random(seed)
+    students = []
+    for i in range(pages):
+        marks = [rng.randint(35, 100) for _ in SUBJECTS]
+        total = sum(marks)
+        sgpa = min(10.0, round(total / len(SUBJECTS) / 10 + rng.uniform(-0.3, 0.3), 2))
+        students.append({
+            "Name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}",
+            "Father": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "Mother": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "Registration": f"REG{2024000 + i}",
+            "Marks": marks,
+            "TotalMarks": total,
+            "SGPA": f"{sgpa:.2f}",
+            "Grade": "A" if sgpa >= 8 else "B" if sgpa >= 6.5 else "C",
+        })
+    return students
+
+
+def make_synthetic_pdf(path, students):
+    """Writes one marksheet page per student, laid out like a university result page."""
+    import fitz  # PyMuPDF
+
+    doc = fitz.open()
+    for student in students:
+        page = doc.new_page()
+        lines = [
+            "UNIVERSITY OF EXAMPLE - SEMESTER EXAMINATION RESULT",
+            "Programme: Bachelor of Technology    Semester: III",
+            f"Student Name : {student['Name']}",
+            f"Father Name : {student['Father']}",
+            f"Mother Name : {student['Mother']}",
+            f"Registration No : {student['Registration']}",
+            "Subject                     Max    Obtained",
+        ]
+        lines += [f"{subject:<28}100    {mark}" for subject, mark in zip(SUBJECTS, student["Marks"])]
+        lines += [
+            f"Total Marks Obtained : {student['TotalMarks']}",
+            f"Total Marks Obtained (in words): {number_to_words(student['TotalMarks'])}",
+            f"SGPA : {student['SGPA']}",
+            f"Grade : {student['Grade']}",
+            "This is a computer generated result. Controller of Examinations",
+        ]
+        y = 60
+        for line in lines:
+            page.insert_text((50, y), line, fontsize=10)
+            y += 16
+    doc.save(path)
+    doc.close()
+
+# ---------------- Mock model server ----------------
+
+FIELD_PATTERNS = {
+    "Name": r"Student Name\s*:\s*(.+)",
+    "Registration": r"Registration No\s*:\s*(\S+)",
+    "TotalMarks": r"Total Marks Obtained\s*:\s*(\d+)",
+    "SGPA": r"SGPA\s*:\s*(\S+)",
+    "Grade": r"Grade\s*:\s*(\S+)",
+}
+
+
+def mock_answer(prompt):
+    """Answers like a well-behaved model: a JSON object, or a JSON array for batch prompts."""
+    def record(text):
+        fields = {}
+        for field, pattern in FIELD_PATTERNS.items():
+            m = re.search(pattern, text)
+            fields[field] = m.group(1).strip() if m else ""
+        return fields
+
+    pages = re.findall(r"Text \(page (\d+)\):\n(.*?)(?=\nText \(page |\Z)", prompt, re.DOTALL)
+    if "JSON array" in prompt:
+        return json.dumps([dict(record(text), Page=int(num)) for num, text in pages])
+    return "Here is the extracted data:\n" + json.dumps(record(prompt), indent=4) + "\nLet me know if you need more."
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    """HTTP server that ignores clients hanging up, e.g. when they stop reading a stream early."""
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+
+class MockModelServer:
+    """
+    Local Ollama-style /api/generate endpoint running in a background thread.
+    Each request takes latency + latency_per_kchar * prompt_kchars (+ up to `jitter`)
+    seconds and fails with HTTP 503 with probability `failure_rate`.
+    """
+
+    def __init__(self, latency=0.05, latency_per_kchar=0.0, jitter=0.0, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.latency_per_kchar = latency_per_kchar
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.failures = 0
+        self.prompt_chars = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = QuietHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}/api/generate"
+
+    def _make_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, content_type="application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                prompt = payload.get("prompt", "")
+                with mock._lock:
+                    mock.requests += 1
+                    mock.prompt_chars += len(prompt)
+                    fail = mock._rng.random() < mock.failure_rate
+                    jitter = mock._rng.uniform(0, mock.jitter)
+                    if fail:
+                        mock.failures += 1
+                time.sleep(mock.latency + mock.latency_per_kchar * len(prompt) / 1000 + jitter)
+                if fail:
+                    self._send(503, b'{"error": "model overloaded"}')
+                    return
+
+                answer = mock_answer(prompt)
+                if not payload.get("stream"):
+                    self._send(200, json.dumps({"model": payload.get("model"), "response": answer, "done": True}).encode())
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    pieces = [answer[i:i + 8] for i in range(0, len(answer), 8)]
+                    for piece in pieces + [""]:
+                        line = json.dumps({"response": piece, "done": piece == ""}).encode() + b"\n"
+                        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                        self.wfile.flush()
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # client stopped reading early
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self.requests, "failures": self.failures, "prompt_chars": self.prompt_chars}
+
+# ---------------- Scenario runner ----------------
+
+
+def parse_scenario(spec):
+    """'name:key=value,key=value' -> (name, {key: value}); values are parsed as JSON when possible."""
+    name, _, params = spec.partition(":")
+    options = {}
+    for item in filter(None, params.split(",")):
+        key, _, value = item.partition("=")
+        try:
+            options[key.strip()] = json.loads(value)
+        except ValueError:
+            options[key.strip()] = value
+    return name, options
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_child(config):
+    """Runs one scenario in this (fresh) process and returns its measurements."""
+    sys.path.insert(0, REPO_DIR)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        import app
+
+        for key, value in config["app_config"].items():
+            app.app.config[key] = value
+            if hasattr(app, key):
+                setattr(app, key, value)
+
+        # Time every page from the moment it is handed out until its entry is written
+        dispatched = {}
+        finished = {}
+        iter_page_records = app.iter_page_records
+
+        def timed_page_records(*args, **kwargs):
+            for record in iter_page_records(*args, **kwargs):
+                dispatched[record[0]] = time.perf_counter()
+                yield record
+
+        writer_add = app.PartialResultWriter.add
+
+        def timed_add(self, page_num, entry, *args, **kwargs):
+            writer_add(self, page_num, entry, *args, **kwargs)
+            finished[page_num] = time.perf_counter()
+
+        app.iter_page_records = timed_page_records
+        app.PartialResultWriter.add = timed_add
+
+        task_id = "benchmark"
+        start = time.perf_counter()
+        app.extract_with_improved(config["pdf_path"], config["endpoint"], task_id, **config["kwargs"])
+        elapsed = time.perf_counter() - start
+        status = app.processing_status.get(task_id, {})
+
+    result = {"status": status.get("status"), "message": status.get("message")}
+    if status.get("status") != "completed":
+        return result
+
+    latencies = [finished[p] - dispatched[p] for p in finished if p in dispatched]
+    pages = len(finished)
+    output_path = os.path.join(app.app.config["OUTPUT_FOLDER"], status["output_file"])
+    result.update({
+        "pages": pages,
+        "records": status.get("records_count"),
+        "time_to_csv_seconds": round(elapsed, 3),
+        "pages_per_second": round(pages / elapsed, 2) if elapsed else None,
+        "page_latency_p50_seconds": round(percentile(latencies, 50), 4) if latencies else None,
+        "page_latency_p99_seconds": round(percentile(latencies, 99), 4) if latencies else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "rules_only_pages": status.get("rules_only_pages"),
+        "prompt_tokens": status.get("prompt_tokens"),
+        "output_path": os.path.abspath(output_path),
+    })
+    return result
+
+
+def accuracy(output_path, students):
+    """Fraction of students whose five fields all match the generated ground truth."""
+    import pandas as pd
+
+    df = pd.read_csv(output_path, dtype=str).fillna("")
+    rows = {row["Registration"]: row for _, row in df.iterrows()}
+    correct = 0
+    for student in students:
+        row = rows.get(student["Registration"])
+        if row is None:
+            continue
+        expected = {"Name": student["Name"], "TotalMarks": str(student["TotalMarks"]),
+                    "SGPA": student["SGPA"], "Grade": student["Grade"]}
+        if all(str(row[field]).strip() == value for field, value in expected.items()):
+            correct += 1
+    return round(correct / len(students), 4) if students else None
+
+
+def run_scenario(name, options, pdf_path, server, workdir, base_config):
+    kwargs = {k: v for k, v in options.items() if k in ("concurrency", "batch_size", "page_workers")}
+    app_config = dict(base_config)
+    app_config.update({k: v for k, v in options.items() if k.isupper()})
+    scenario_dir = os.path.join(workdir, name)
+    os.makedirs(scenario_dir, exist_ok=True)
+    app_config["OUTPUT_FOLDER"] = os.path.join(scenario_dir, "outputs")
+    config = {"pdf_path": pdf_path, "endpoint": server.url, "kwargs": kwargs, "app_config": app_config}
+
+    before = server.stats()
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", json.dumps(config)],
+        cwd=scenario_dir, capture_output=True, text=True
+    )
+    after = server.stats()
+    if proc.returncode != 0:
+        return {"scenario": name, "status": "error", "message": proc.stderr.strip()[-2000:]}
+
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["scenario"] = name
+    result["options"] = options
+    result["model_requests"] = after["requests"] - before["requests"]
+    result["model_failures"] = after["failures"] - before["failures"]
+    result["model_prompt_chars"] = after["prompt_chars"] - before["prompt_chars"]
+    return result
+
+
+def finish_result(result, students):
+    """Adds the accuracy of a finished scenario and prints its summary line."""
+    if result.get("status") == "completed":
+        result["accuracy"] = accuracy(result.pop("output_path"), students)
+        print(f"   {result['pages_per_second']} pages/s, p50 {result['page_latency_p50_seconds']}s, "
+              f"p99 {result['page_latency_p99_seconds']}s, CSV after {result['time_to_csv_seconds']}s, "
+              f"peak RSS {result['peak_rss_mb']} MB, accuracy {result['accuracy']}")
+    else:
+        print(f"   ❌ {result.get('message')}")
+    return result
+
+
+def run_memory_benchmark(sizes, scenario, args, base_config, server):
+    """
+    Runs one scenario on synthetic PDFs of each size in `sizes` (pages). Peak RSS should
+    stay flat as the page count grows; the spread is reported as rss_growth_mb.
+    """
+    name, options = scenario
+    results = []
+    with tempfile.TemporaryDirectory(prefix="extractor-bench-") as workdir:
+        for pages in sizes:
+            print(f"⏱️  Running scenario '{name}' {options} on {pages} pages...")
+            students = make_students(pages, args.seed)
+            pdf_path = os.path.join(workdir, f"synthetic_{pages}.pdf")
+            make_synthetic_pdf(pdf_path, students)
+            result = run_scenario(f"{name}_{pages}", options, pdf_path, server, workdir, base_config)
+            results.append(finish_result(result, students))
+            os.remove(pdf_path)
+    peaks = [result["peak_rss_mb"] for result in results if result.get("peak_rss_mb") is not None]
+    return {
+        "sizes": sizes,
+        "peak_rss_mb": [result.get("peak_rss_mb") for result in results],
+        "rss_growth_mb": round(max(peaks) - min(peaks), 1) if peaks else None,
+        "results": results,
+    }
+
+
+# ---------------- Label matching micro-benchmark ----------------
+# Per-call regex versions of the page label helpers, as they were before LabelMatcher
+
+def legacy_father_mother_names(line_texts):
+    father = None
+    mother = None
+    for line_text in line_texts:
+        m = re.search(r"Father\s*Name\s*[:\-]\s*(.+)", line_text, re.IGNORECASE)
+        if m:
+            father = m.group(1).strip()
+        m2 = re.search(r"Mother\s*Name\s*[:\-]\s*(.+)", line_text, re.IGNORECASE)
+        if m2:
+            mother = m2.group(1).strip()
+        if father and mother:
+            break
+    return father, mother
+
+
+def legacy_rule_fields(app, line_texts):
+    fields = {}
+    for line in line_texts:
+        if "Registration" not in fields:
+            m = app.REGISTRATION_RULE.search(line)
+            if m:
+                fields["Registration"] = m.group(1).strip()
+        if "SGPA" not in fields:
+            m = app.SGPA_RULE.search(line)
+            if m and float(m.group(1)) <= 10:
+                fields["SGPA"] = m.group(1)
+        if "Grade" not in fields:
+            m = app.GRADE_RULE.search(line)
+            if m:
+                fields["Grade"] = m.group(1).upper()
+        if "TotalMarks" not in fields:
+            m = app.TOTAL_MARKS_RULE.search(line)
+            if m:
+                fields["TotalMarks"] = m.group(1)
+    return fields
+
+
+def legacy_name_from_lines(lines_by_y, name_label_patterns, father_name=None, mother_name=None):
+    for idx, (ln_text, y) in enumerate(lines_by_y):
+        for pat in name_label_patterns:
+            if re.search(rf"\b{pat.pattern.split(r'\s*[:\-]?')[0]}\b", ln_text, re.IGNORECASE):
+                m = pat.search(ln_text)
+                if m and m.group(1).strip():
+                    candidate = m.group(1).strip()
+                    if father_name and candidate.lower() == father_name.lower():
+                        return None
+                    if mother_name and candidate.lower() == mother_name.lower():
+                        return None
+                    return candidate
+                if idx + 1 < len(lines_by_y) and lines_by_y[idx + 1][0].strip():
+                    candidate = lines_by_y[idx + 1][0].strip()
+                    if father_name and candidate.lower() == father_name.lower():
+                        return None
+                    if mother_name and candidate.lower() == mother_name.lower():
+                        return None
+                    return candidate
+    return None
+
+
+def legacy_parent_label_check(model_name, page_text):
+    lower = page_text.lower()
+    for label in ["father name", "mother name", "parent", "guardian"]:
+        p1 = rf"{label}\s*[:\-]?\s*{re.escape(model_name.lower())}"
+        p2 = rf"{re.escape(model_name.lower())}\s*[:\-]?\s*{label}"
+        if re.search(p1, lower) or re.search(p2, lower):
+            return True
+    return False
+
+
+def run_label_benchmark(pages, seed, rounds=5):
+    """Times the per-call regex label helpers against LabelMatcher on the pages of a synthetic PDF."""
+    import fitz  # PyMuPDF
+
+    sys.path.insert(0, REPO_DIR)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        import app
+
+    students = make_students(pages, seed)
+    with tempfile.TemporaryDirectory(prefix="extractor-bench-") as workdir:
+        pdf_path = os.path.join(workdir, "synthetic.pdf")
+        make_synthetic_pdf(pdf_path, students)
+        doc = fitz.open(pdf_path)
+        layouts = [app.PageLayout(page).detach() for page in doc]
+        doc.close()
+
+    variants = list(app.DEFAULT_NAME_LABELS)
+    patterns = app.find_label_variants(variants)
+    labels = app.label_matcher(variants)
+    page_inputs = [(layout, layout.line_texts, layout.lines_by_y, student["Father"])
+                   for layout, student in zip(layouts, students)]
+
+    def legacy():
+        results = []
+        for layout, line_texts, lines_by_y, model_name in page_inputs:
+            father, mother = legacy_father_mother_names(line_texts)
+            fields = legacy_rule_fields(app, line_texts)
+            name = legacy_name_from_lines(lines_by_y, patterns, father, mother)
+            results.append((father, mother, fields, name, legacy_parent_label_check(model_name, layout.text)))
+        return results
+
+    def matcher():
+        results = []
+        for layout, _line_texts, _lines_by_y, model_name in page_inputs:
+            layout._label_scans.clear()
+            father, mother = app.extract_father_mother_names(layout, labels)
+            fields = dict(layout.label_scan(labels).fields)
+            name = app.extract_name_from_lines(layout, labels, father, mother)
+            results.append((father, mother, fields, name,
+                            app.sanitize_model_name(model_name, layout.text, father, mother) is None))
+        return results
+
+    timings = {}
+    for label, func in (("legacy", legacy), ("label_matcher", matcher)):
+        best = None
+        for _ in range(rounds):
+            start = time.perf_counter()
+            results = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[label] = (best, results)
+
+    # Total-marks words are left out of legacy_rule_fields, so compare without them
+    same = all(
+        old[:2] == new[:2] and old[3:] == new[3:] and old[2] == {k: v for k, v in new[2].items() if k in old[2]}
+        for old, new in zip(timings["legacy"][1], timings["label_matcher"][1])
+    )
+    legacy_seconds, matcher_seconds = timings["legacy"][0], timings["label_matcher"][0]
+    return {
+        "pages": pages,
+        "lines": sum(len(layout.lines) for layout in layouts),
+        "legacy_seconds": round(legacy_seconds, 4),
+        "label_matcher_seconds": round(matcher_seconds, 4),
+        "speedup": round(legacy_seconds / matcher_seconds, 2) if matcher_seconds else None,
+        "same_results": same,
+    }
+
+
+def run_benchmark(args, scenarios, base_config):
+    """Runs every scenario on one synthetic PDF of args.pages pages."""
+    print(f"🧪 Benchmark: {args.pages} pages, {len(scenarios)} scenario(s)")
+    with tempfile.TemporaryDirectory(prefix="extractor-bench-") as workdir:
+        students = make_students(args.pages, args.seed)
+        pdf_path = os.path.join(workdir, "synthetic.pdf")
+        make_synthetic_pdf(pdf_path, students)
+
+        server = MockModelServer(args.latency, args.latency_per_kchar, args.jitter,
+                                 args.failure_rate, args.seed).start()
+        results = []
+        try:
+            for name, options in scenarios:
+                print(f"⏱️  Running scenario '{name}' {options}...")
+                result = run_scenario(name, options, pdf_path, server, workdir, base_config)
+                results.append(finish_result(result, students))
+        finally:
+            server.stop()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark extract_with_improved() against a mock model server")
+    parser.add_argument("--pages", type=int, default=100, help="pages in the synthetic PDF")
+    parser.add_argument("--latency", type=float, default=0.05, help="base mock model latency per request (s)")
+    parser.add_argument("--latency-per-kchar", type=float, default=0.0,
+                        help="extra mock latency per 1000 prompt characters (s)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency up to this (s)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="probability of an HTTP 503 answer")
+    parser.add_argument("--scenario", action="append",
+                        help="name:key=value,... with extract_with_improved() options (concurrency, batch_size, "
+                             "page_workers) or UPPERCASE app.py settings; repeatable")
+    parser.add_argument("--rules", action="store_true",
+                        help="keep the rule-based fast path on (it answers every synthetic page without the model)")
+    parser.add_argument("--cache", action="store_true", help="keep the extraction cache on")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--labels", action="store_true",
+                        help="only run the label matching micro-benchmark (LabelMatcher against per-call regexes)")
+    parser.add_argument("--memory", metavar="SIZES",
+                        help="comma-separated page counts: run the first scenario on a PDF of each size and "
+                             "compare peak RSS (e.g. 100,1000,10000)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(json.loads(args.child))))
+        return
+    if args.labels:
+        print(json.dumps(dict(run_label_benchmark(args.pages, args.seed), commit=git_commit()), indent=2))
+        return
+
+    base_config = {"RULES_FIRST": args.rules, "CACHE_ENABLED": args.cache}
+    scenarios = [parse_scenario(spec) for spec in (args.scenario or DEFAULT_SCENARIOS)]
+
+    if args.memory:
+        sizes = [int(size) for size in args.memory.split(",")]
+        print(f"🧪 Memory benchmark: {sizes} pages, scenario '{scenarios[0][0]}'")
+        server = MockModelServer(args.latency, args.latency_per_kchar, args.jitter,
+                                 args.failure_rate, args.seed).start()
+        try:
+            memory = run_memory_benchmark(sizes, scenarios[0], args, base_config, server)
+        finally:
+            server.stop()
+        print(f"📈 Peak RSS {memory['peak_rss_mb']} MB, growth {memory['rss_growth_mb']} MB")
+        results = memory.pop("results")
+    else:
+        memory = None
+        results = run_benchmark(args, scenarios, base_config)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "params": {
+            "pages": args.pages, "latency": args.latency, "latency_per_kchar": args.latency_per_kchar,
+            "jitter": args.jitter, "failure_rate": args.failure_rate, "rules": args.rules,
+            "cache": args.cache, "seed": args.seed,
+        },
+        "results": results,
+    }
+    if memory:
+        report["memory"] = memory
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Report written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -70,7 +70,8 @@ def main():
     
     # Start the Flask application
     try:
-        from app import app
+        from app import app, start_serving_process
+        start_serving_process(use_reloader=True)
         app.run(debug=True, host='0.0.0.0', port=5000)
     except KeyboardInterrupt:
         print("\n👋 Server stopped by user")
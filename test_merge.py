@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Checks that the columnar post-processing gives the same results as the record-by-record
+merge: merge_students_frame() against merge_students(), and postprocess_results() against
+merging the stripped page entries, and the chunked pipeline that writes every result
+(merge_result_chunks(), postprocess_result_parts(), write_results()) against
+post-processing and writing all entries at once. Run with `python test_merge.py` (or pytest).
+"""
+
+import os
+import random
+import sys
+import tempfile
+
+import pandas as pd
+
+import app
+
+VALUES = {
+    "Name": ["", "A B", " C ", "Dee", None],
+    "Registration": ["", " ", "R1", "R2", " R1", "R3 ", None],
+    "TotalMarks": ["", 0, 415, "Four Hundred", None, "4,15", 12.7, "x1", float("inf"), float("-inf")],
+    "SGPA": ["", "8.5", " 9.1 ", "0"],
+    "Grade": ["", "A", "B+"],
+}
+
+
+def random_entries(rng, n):
+    return [{field: rng.choice(values) for field, values in VALUES.items()} for _ in range(n)]
+
+
+def normalized(records):
+    """Records with NaN and None both as None, so the two merges can be compared."""
+    return [{k: None if v is None or (isinstance(v, float) and v != v) else v for k, v in r.items()}
+            for r in records]
+
+
+def stripped(entries):
+    """Entries as build_entry() writes them: text fields are stripped strings."""
+    return [dict(e, **{f: (e[f] or "").strip() for f in ("Name", "Registration", "SGPA", "Grade")})
+            for e in entries]
+
+
+def read_output(path, output_format):
+    """A results file as an Arrow table (Parquet, Arrow) or a DataFrame of strings (CSV variants)."""
+    if output_format == "parquet":
+        return app.pq.read_table(path)
+    if output_format == "arrow":
+        return app.pa.ipc.open_file(path).read_all()
+    return pd.read_csv(path, dtype=str, keep_default_na=False)
+
+
+def test_merge_students_frame():
+    """merge_students_frame() merges like merge_students()"""
+    rng = random.Random(1)
+    for _ in range(500):
+        entries = random_entries(rng, rng.randint(0, 12))
+        expected = app.merge_students(stripped(entries))
+        got = app.merge_students_frame(pd.DataFrame(stripped(entries), dtype=object)).to_dict("records")
+        assert normalized(got) == normalized(expected), entries
+
+
+def test_postprocess_results():
+    """postprocess_results() writes the same CSV as merge_students()"""
+    rng = random.Random(2)
+    for _ in range(300):
+        entries = [e for e in stripped(random_entries(rng, rng.randint(1, 12)))
+                   if isinstance(e["TotalMarks"], (str, int))]
+        expected = pd.DataFrame(app.merge_students(entries), columns=app.RESULT_FIELDS)
+        got = app.postprocess_results(pd.DataFrame(entries, columns=app.RESULT_FIELDS, dtype=object))
+        assert got.to_csv(index=False) == expected.to_csv(index=False), entries
+
+
+def test_infinite_total_marks():
+    """A total the model answered as 1e999 (inf) is left empty, as clean_total_marks() leaves it"""
+    entries = [{"Name": "A", "Registration": f"R{i}", "TotalMarks": v, "SGPA": "8", "Grade": "A"}
+               for i, v in enumerate([float("inf"), float("-inf"), float("nan"), 415.0])]
+    df = app.postprocess_results(pd.DataFrame(entries, columns=app.RESULT_FIELDS, dtype=object), True)
+    assert [None if pd.isna(v) else v for v in df["TotalMarks"]] == \
+        [app.clean_total_marks(e["TotalMarks"]) for e in entries] == [None, None, None, 415]
+
+
+def test_postprocess_result_parts():
+    """Merging entries chunk by chunk gives the same results as merging them at once"""
+    rng = random.Random(3)
+    for _ in range(40):
+        entries = random_entries(rng, rng.randint(0, 40))
+        size = rng.randint(1, 10)
+        chunks = [entries[i:i + size] for i in range(0, len(entries), size)]
+        for numeric in (False, True):
+            expected = app.postprocess_results(pd.DataFrame(entries, columns=app.RESULT_FIELDS, dtype=object), numeric)
+            parts = list(app.postprocess_result_parts(list(app.merge_result_chunks(chunks)), numeric))
+            got = "".join(part.to_csv(index=False, header=i == 0) for i, part in enumerate(parts))
+            assert got == (expected.to_csv(index=False) if parts else ""), (entries, size)
+
+
+def test_write_result_parts():
+    """Writing the merged parts one by one gives the same file as writing the whole result"""
+    rng = random.Random(4)
+    formats = ["csv", "csv.gz"] + (["parquet", "arrow"] if app.pa is not None else [])
+    with tempfile.TemporaryDirectory() as folder:
+        for trial in range(20):
+            entries = random_entries(rng, rng.randint(0, 40)) if trial else []
+            size = rng.randint(1, 10)
+            chunks = [entries[i:i + size] for i in range(0, len(entries), size)]
+            for output_format in formats:
+                expected_path = os.path.join(folder, "expected." + output_format)
+                got_path = os.path.join(folder, "got." + output_format)
+                df = app.postprocess_results(pd.DataFrame(entries, columns=app.RESULT_FIELDS, dtype=object), True)
+                assert app.write_results(df, expected_path, output_format, row_group_size=4) == len(df)
+                parts = app.postprocess_result_parts(list(app.merge_result_chunks(chunks)), True)
+                assert app.write_results(parts, got_path, output_format, row_group_size=4) == len(df)
+                got, expected = read_output(got_path, output_format), read_output(expected_path, output_format)
+                assert got.equals(expected), (entries, size, output_format)
+
+
+def main():
+    tests = [test_merge_students_frame, test_postprocess_results, test_infinite_total_marks,
+             test_postprocess_result_parts,
+             test_write_result_parts]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__doc__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__doc__}: {e}")
+    return failed == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
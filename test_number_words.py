@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Checks of the total marks parsing: words_to_number() against word2number for spelled-out
+numbers, and clean_total_marks() / coerce_total_marks() on inputs that cannot be parsed.
+Run with `python test_number_words.py` (or pytest).
+"""
+
+import sys
+
+import pandas as pd
+from word2number import w2n
+
+import app
+
+ONES = ["zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten", "eleven",
+        "twelve", "thirteen", "fourteen", "fifteen", "sixteen", "seventeen", "eighteen", "nineteen"]
+TENS = ["", "", "twenty", "thirty", "forty", "fifty", "sixty", "seventy", "eighty", "ninety"]
+
+
+def spell(n, hyphen=False, use_and=False):
+    """English words for 0 <= n < 1,000,000, e.g. 'four hundred and fifteen'."""
+    def below_100(n):
+        if n < 20:
+            return ONES[n]
+        return TENS[n // 10] + (("-" if hyphen else " ") + ONES[n % 10] if n % 10 else "")
+
+    if n == 0:
+        return "zero"
+    parts = []
+    if n >= 1000:
+        parts.append(spell(n // 1000, hyphen) + " thousand")
+        n %= 1000
+    if n >= 100:
+        parts.append(ONES[n // 100] + " hundred")
+        n %= 100
+    if n:
+        parts.append(("and " if use_and and parts else "") + below_100(n))
+    return " ".join(parts)
+
+
+def test_matches_word2number():
+    """words_to_number() agrees with word2number on spelled-out numbers"""
+    for n in list(range(0, 1200)) + list(range(1200, 1000000, 997)):
+        for text in (spell(n), spell(n, hyphen=True, use_and=True).title()):
+            assert app.words_to_number(text) == w2n.word_to_num(text.lower()) == n, text
+
+
+def test_number_word_forms():
+    """Indian scales, decimals and surrounding words"""
+    assert app.words_to_number("One Lakh Twenty Five Thousand Four Hundred") == 125400
+    assert app.words_to_number("two crore five lakh") == 20500000
+    assert app.words_to_number("nine point five") == 9.5
+    assert app.words_to_number("Four Hundred Fifteen Only") == 415
+    assert app.words_to_number("415") == 415
+
+
+def test_unparseable_words():
+    """words_to_number() returns None instead of raising"""
+    for text in ["", "  ", "SGPA", "grade a", "four thousand two thousand", "one point two point three", "²", "½"]:
+        assert app.words_to_number(text) is None, text
+
+
+def test_malformed_hundreds():
+    """A 'hundred' after a value of a hundred or more makes the phrase unparseable"""
+    for text in ["five hundred hundred", "four hundred fifteen marks out of five hundred",
+                 "Four Hundred Fifteen Maximum Marks Five Hundred", "one thousand two hundred three hundred"]:
+        assert app.words_to_number(text) is None, text
+        assert app.clean_total_marks(text) is None, text
+    assert app.words_to_number("twenty five hundred") == 2500
+    assert app.words_to_number("five hundred thousand") == 500000
+
+
+def test_clean_total_marks():
+    """clean_total_marks() handles numbers, separators, words and junk"""
+    assert app.clean_total_marks("1,234") == 1234
+    assert app.clean_total_marks(" 456 ") == 456
+    assert app.clean_total_marks(456.0) == 456
+    assert app.clean_total_marks("Four Hundred and Fifteen") == 415
+    for value in [None, "", "²", "N/A", float("nan"), float("inf")]:
+        assert app.clean_total_marks(value) is None, repr(value)
+
+
+def test_coerce_total_marks():
+    """coerce_total_marks() gives the same values as clean_total_marks() per row"""
+    values = ["456", " 1,234 ", "four hundred", "²", "", None, float("nan"), 512, 300.0, "N/A"]
+    result = app.coerce_total_marks(pd.Series(values, dtype=object))
+    assert str(result.dtype) == "Int64"
+    expected = [app.clean_total_marks(v) for v in values]
+    assert [None if pd.isna(v) else v for v in result] == expected, list(result)
+
+
+def main():
+    tests = [test_matches_word2number, test_number_word_forms, test_unparseable_words,
+             test_malformed_hundreds, test_clean_total_marks, test_coerce_total_marks]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__doc__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__doc__}: {e}")
+    return failed == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Checks of the rule-based field extraction (RULES_FIRST): values that are read with
+confidence, and values that must fall back to the model instead of being cut short.
+Run with `python test_rules.py` (or pytest).
+"""
+
+import sys
+
+import app
+
+
+def scan(*lines):
+    return app.label_matcher().scan(list(lines)).fields
+
+
+def test_full_values():
+    """Plain labelled values are read whole"""
+    fields = scan("Registration No: 21BCE1234 Name: Asha", "SGPA : 7.875", "Total Marks Obtained : 456", "Grade: A+")
+    assert fields == {"Registration": "21BCE1234", "SGPA": "7.875", "TotalMarks": "456", "Grade": "A+"}, fields
+    assert scan("Reg. No.: 2021/CS-045")["Registration"] == "2021/CS-045"
+    assert scan("Reg No: 12345 SGPA: 8.1") == {"Registration": "12345", "SGPA": "8.1"}
+
+
+def test_value_followed_by_punctuation():
+    """A full stop or comma after a value ends it"""
+    assert scan("SGPA: 7.5.") == {"SGPA": "7.5"}
+    assert scan("SGPA: 7.5, Grade: B") == {"SGPA": "7.5", "Grade": "B"}
+    assert scan("Total Marks Obtained: 456, Result: Pass") == {"TotalMarks": "456"}
+
+
+def test_thousands_separator():
+    """Totals with thousands separators are read without the separator"""
+    assert scan("Total Marks Obtained : 1,234") == {"TotalMarks": "1234"}
+
+
+def test_partial_values_fall_back():
+    """Values the rules can only read in part are left to the model"""
+    assert scan("SGPA: 123") == {}
+    assert scan("Total Marks Obtained: 12345") == {}
+    assert scan("Total Marks Obtained: 1,23") == {}
+    assert scan("Total Marks Obtained: 456.5") == {}
+    assert scan("Registration No: 21BCE 1234") == {}
+    assert scan("SGPA: 11.5") == {}
+
+
+def test_total_marks_in_words():
+    """Totals in words go through words_to_number()"""
+    assert scan("Total Marks Obtained (in words): Four Hundred and Fifteen") == {"TotalMarks": "415"}
+
+
+def main():
+    tests = [test_full_values, test_value_followed_by_punctuation, test_thousands_separator,
+             test_partial_values_fall_back, test_total_marks_in_words]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__doc__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__doc__}: {e}")
+    return failed == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
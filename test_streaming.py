@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Checks of the early-stop parsing of streamed model responses (MODEL_STREAMING):
+first_complete_json() and the stop conditions built on it. Run with
+`python test_streaming.py` (or pytest).
+"""
+
+import json
+import sys
+
+import app
+
+ANSWER = {"Name": "Asha {Rao}", "Registration": "R1", "TotalMarks": "415", "SGPA": "8.5", "Grade": "A"}
+
+
+def test_stops_only_when_complete():
+    """Every prefix of a streamed answer is incomplete until its closing brace"""
+    text = 'Here is the JSON: ' + json.dumps(ANSWER) + '\nLet me know if you need more.'
+    end = text.index("}", text.index("Grade")) + 1
+    for i in range(len(text) + 1):
+        got = app.first_complete_json(text[:i])
+        if i < end:
+            assert got is None, text[:i]
+        else:
+            assert json.loads(got) == ANSWER, text[:i]
+
+
+def test_brackets_inside_strings():
+    """Brackets and escaped quotes inside strings do not count"""
+    text = '{"Name": "a } b ] \\" { c", "x": [1, {"y": "]"}]} trailing }'
+    assert app.first_complete_json(text) == text[:text.index(" trailing")]
+    assert app.first_complete_json('{"Name": "\\\\"}, rest') == '{"Name": "\\\\"}'
+
+
+def test_arrays():
+    """Batch answers are read up to the end of the first array"""
+    text = 'Results: [{"page": 1, "Name": "[A]"}, {"page": 2}] and more [3]'
+    assert json.loads(app.first_complete_json(text, "[")) == [{"page": 1, "Name": "[A]"}, {"page": 2}]
+    assert app.first_complete_json('[{"page": 1}, {"page"', "[") is None
+    assert app.first_complete_json("no json here") is None
+
+
+def test_stop_conditions():
+    """A single-page answer stops once every result field is there; a batch once the array closes"""
+    assert app.complete_result_object(json.dumps(ANSWER))
+    assert not app.complete_result_object('{"Name": "A", "Registration": "R1"}')
+    assert not app.complete_result_object('{"Name": "A", ')
+    assert not app.complete_result_object("{not json}")
+    assert app.complete_result_array('[{"page": 1}]')
+    assert not app.complete_result_array('[{"page": 1},')
+
+
+def main():
+    tests = [test_stops_only_when_complete, test_brackets_inside_strings, test_arrays, test_stop_conditions]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__doc__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__doc__}: {e}")
+    return failed == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)